@@ -0,0 +1,82 @@
+"""Compare vector, BM25 and hybrid product retrieval on a labelled query set.
+
+Reports recall@k, mean reciprocal rank and per-query latency for each
+retrieval mode against the ChromaDB collection built by init_database.py.
+
+    python benchmark_retrieval.py [--k 5] [--runs 3]
+"""
+import argparse
+import time
+
+from main import ChromaProductSearch
+
+# (query, ids of the products a good answer should retrieve)
+QUERIES = [
+    ("RoboTech Pro", {"1"}),
+    ("How much is the Digital Microscope Pro?", {"2"}),
+    ("ChemMaster chemistry set", {"3"}),
+    ("telescope for stargazing", {"7"}),
+    ("robotics kit for teenagers", {"1", "40"}),
+    ("learn to code with python and machine learning", {"5"}),
+    ("watercolor painting supplies", {"19"}),
+    ("books about world history", {"28"}),
+    ("toys for preschool children to learn math", {"46", "44"}),
+    ("phonics reading for kindergarten", {"45"}),
+    ("interactive whiteboard for the classroom", {"47"}),
+    ("3D printer", {"42"}),
+    ("virtual reality headset", {"39"}),
+    ("weather station", {"12"}),
+    ("SmartGlobe Pro", {"38"}),
+    ("solar and wind energy experiments", {"13"}),
+    ("pottery clay wheel", {"18"}),
+    ("language learning for kids", {"30", "50"}),
+    ("anatomy of the human body", {"14"}),
+    ("internet of things sensors programming", {"43"}),
+    ("calligraphy pens", {"21"}),
+    ("philosophy books", {"32"}),
+    ("animation for kids", {"25"}),
+    ("electronics circuits lab", {"8"}),
+]
+
+
+def evaluate(search: ChromaProductSearch, mode: str, k: int, runs: int) -> dict:
+    search.retrieval_mode = mode
+    search.search_products(QUERIES[0][0], k)  # build the BM25 index and load the embedding model first
+    recall = 0.0
+    reciprocal_rank = 0.0
+    latencies = []
+    short_circuits = search.lexical_short_circuits
+    for query, relevant in QUERIES:
+        for _ in range(runs):
+            start = time.perf_counter()
+            products = search.search_products(query, k)
+            latencies.append(time.perf_counter() - start)
+        ids = [product.get('id') for product in products]
+        recall += len(relevant.intersection(ids)) / len(relevant)
+        reciprocal_rank += next((1.0 / rank for rank, product_id in enumerate(ids, 1) if product_id in relevant), 0.0)
+    latencies.sort()
+    return {
+        "recall": recall / len(QUERIES),
+        "mrr": reciprocal_rank / len(QUERIES),
+        "p50_ms": 1000 * latencies[len(latencies) // 2],
+        "p95_ms": 1000 * latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+        "short_circuits": (search.lexical_short_circuits - short_circuits) // runs
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark product retrieval modes")
+    parser.add_argument("--k", type=int, default=5, help="products retrieved per query")
+    parser.add_argument("--runs", type=int, default=3, help="timed repetitions of each query")
+    args = parser.parse_args()
+
+    search = ChromaProductSearch()
+    if not search.collection:
+        raise SystemExit("❌ ChromaDB collection not found, run init_database.py first")
+
+    print(f"{len(QUERIES)} queries, k={args.k}")
+    print(f"{'mode':<8} {'recall@k':>9} {'MRR':>6} {'p50 ms':>8} {'p95 ms':>8} {'lexical only':>13}")
+    for mode in ("vector", "lexical", "hybrid"):
+        result = evaluate(search, mode, args.k, args.runs)
+        print(f"{mode:<8} {result['recall']:>9.3f} {result['mrr']:>6.3f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['short_circuits']:>6}/{len(QUERIES)}")
\ No newline at end of file
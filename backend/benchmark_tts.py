@@ -0,0 +1,86 @@
+"""Compare TTS backends on synthesis latency and throughput.
+
+Synthesizes English and Khmer sentences with each backend, bypassing the
+audio cache: one at a time for per-sentence latency, then from
+--concurrency threads at once for throughput. Backends that don't support
+a language (espeak-ng has no Khmer voice) or can't be reached (gTTS
+offline) are reported as such.
+
+    python benchmark_tts.py [--backends gtts espeak] [--runs 2] [--concurrency 4]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main import HTTPX_AVAILABLE, EspeakBackend, GTTSBackend, PooledHTTPClient
+
+SENTENCES = {
+    "en": [
+        "Welcome to EduSmart Store!",
+        "The Digital Microscope Pro costs $129.99 and is in stock.",
+        "This robotics kit teaches coding with sensors, motors and a visual programming app.",
+        "It suits ages 14 to 18.",
+        "Would you like to know more about our science kits for younger children?",
+    ],
+    "km": [
+        "សូមស្វាគមន៍មកកាន់ហាង EduSmart!",
+        "មីក្រូទស្សន៍ឌីជីថលនេះមានតម្លៃ ១២៩ ដុល្លារ។",
+        "តើអ្នកចង់ដឹងបន្ថែមអំពីផលិតផលនេះទេ?",
+    ],
+}
+
+
+def evaluate(backend, lang: str, runs: int, concurrency: int) -> dict:
+    sentences = SENTENCES[lang]
+    backend.synthesize(sentences[0], lang)  # warm up connections / the executable's page cache
+    latencies = []
+    audio_bytes = 0
+    for _ in range(runs):
+        for sentence in sentences:
+            start = time.perf_counter()
+            audio_bytes += len(backend.synthesize(sentence, lang))
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    jobs = sentences * runs
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda sentence: backend.synthesize(sentence, lang), jobs))
+        elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": 1000 * latencies[len(latencies) // 2],
+        "p95_ms": 1000 * latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+        "throughput": len(jobs) / elapsed,
+        "kb_per_sentence": audio_bytes / len(latencies) / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TTS backends")
+    parser.add_argument("--backends", nargs="+", default=["gtts", "espeak"], choices=["gtts", "espeak"])
+    parser.add_argument("--runs", type=int, default=2, help="timed passes over the sentences")
+    parser.add_argument("--concurrency", type=int, default=4, help="threads for the throughput pass")
+    args = parser.parse_args()
+
+    http_client = PooledHTTPClient() if HTTPX_AVAILABLE else None
+    backends = {
+        "gtts": GTTSBackend(http_client, os.getenv("GTTS_BASE_URL") or None),
+        "espeak": EspeakBackend(os.getenv("ESPEAK_NG_PATH", "espeak-ng")),
+    }
+
+    print(f"{'backend':<8} {'lang':<5} {'p50 ms':>8} {'p95 ms':>8} {'sent/s':>8} {'KB/sent':>8}")
+    for name in args.backends:
+        backend = backends[name]
+        for lang in SENTENCES:
+            if not backend.supports(lang):
+                print(f"{name:<8} {lang:<5} {'not available':>35}")
+                continue
+            try:
+                result = evaluate(backend, lang, args.runs, args.concurrency)
+            except Exception as e:
+                print(f"{name:<8} {lang:<5} error: {e}")
+                continue
+            print(f"{name:<8} {lang:<5} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                  f"{result['throughput']:>8.1f} {result['kb_per_sentence']:>8.1f}")
+    if http_client:
+        http_client.close()
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Check that gTTS requests reuse pooled keep-alive connections.
+
+Starts a local stand-in for the Google TTS endpoint that counts TCP
+connections, points TextToSpeechService at it through GTTS_BASE_URL and
+synthesizes --requests distinct sentences: once through the shared
+PooledHTTPClient and once without keep-alive, which is how gTTS behaves on
+its own (a new connection per call).
+
+    python check_http_pool.py [--requests 20] [--latency-ms 0]
+"""
+import argparse
+import base64
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_MP3 = b"ID3" + bytes(64)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    connections = 0
+    requests = 0
+    lock = threading.Lock()
+    latency = 0.0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            StandInHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            StandInHandler.requests += 1
+        time.sleep(self.latency)
+        audio = base64.b64encode(FAKE_MP3).decode("ascii")
+        body = f')]}}\'\n\n[["wrb.fr","jQ1olc","[\\"{audio}\\"]",null,null,null,"generic"]]\n'.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(service, count: int, label: str):
+    StandInHandler.connections = StandInHandler.requests = 0
+    start = time.perf_counter()
+    for i in range(count):
+        if service.synthesize(f"Check sentence number {i} for {label}.") is None:
+            raise SystemExit(f"❌ {label}: synthesis failed")
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {StandInHandler.requests:>8} {StandInHandler.connections:>11} {1000 * elapsed / count:>9.2f}")
+    return StandInHandler.connections
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count connections opened by pooled vs. unpooled gTTS requests")
+    parser.add_argument("--requests", type=int, default=20, help="sentences to synthesize per mode")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay the stand-in server adds per request")
+    args = parser.parse_args()
+
+    StandInHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GTTS_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["TTS_CACHE_DIR"] = ""  # every sentence must reach the server
+
+    from main import HTTPX_AVAILABLE, PooledHTTPClient, TextToSpeechService
+    if not HTTPX_AVAILABLE:
+        raise SystemExit("❌ httpx is not installed, gTTS falls back to a connection per call")
+
+    print(f"{'mode':<14} {'requests':>8} {'connections':>11} {'ms/req':>9}")
+    pool = PooledHTTPClient()
+    pooled = run(TextToSpeechService(pool), args.requests, "pooled")
+    pool.close()
+    no_keepalive = PooledHTTPClient(max_keepalive=0)
+    unpooled = run(TextToSpeechService(no_keepalive), args.requests, "no keep-alive")
+    no_keepalive.close()
+    server.shutdown()
+
+    if pooled == 1:
+        print(f"✅ Pooled requests shared one connection ({unpooled} without keep-alive)")
+    else:
+        raise SystemExit(f"❌ Pooled requests opened {pooled} connections")
\ No newline at end of file
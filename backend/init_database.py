@@ -1,7 +1,18 @@
 # init_database.py
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
 import sqlite3
+import time
 import chromadb
 import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
 def init_databases():
     """Initialize SQLite database and ChromaDB vector store"""
@@ -12,13 +23,11 @@ def init_databases():
     # Initialize ChromaDB for product embeddings
     init_chromadb()
 
-def init_sqlite_db():
-    """Initialize SQLite database with required tables"""
-    conn = sqlite3.connect('education_store.db')
-    cur = conn.cursor()
-    
-    # Create conversation_history table
-    cur.execute("""
+# Ordered SQLite schema migrations. PRAGMA user_version records how many
+# have been applied, so append new steps to the end and never edit old ones.
+MIGRATIONS = [
+    ("create conversation_history", [
+        """
         CREATE TABLE IF NOT EXISTS conversation_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id TEXT NOT NULL,
@@ -28,24 +37,561 @@ def init_sqlite_db():
             timestamp TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    """)
-    
-    conn.commit()
+        """
+    ]),
+    ("index conversation_history by session", [
+        # Serves the history lookup (WHERE user_id AND session_id ORDER BY timestamp DESC LIMIT n)
+        # as an index range scan, and the per-session GROUP BY in compaction without touching the table
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversation_history_session
+        ON conversation_history (user_id, session_id, timestamp)
+        """
+    ]),
+    ("create conversation_archive", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            turn_count INTEGER NOT NULL,
+            first_timestamp TIMESTAMP,
+            last_timestamp TIMESTAMP,
+            transcript TEXT NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversation_archive_session
+        ON conversation_archive (user_id, session_id)
+        """
+    ]),
+    ("create conversation_summaries", [
+        # Rolling per-session summary: one line per turn, newest last, capped in length
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            turn_count INTEGER NOT NULL,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (user_id, session_id)
+        )
+        """
+    ]),
+    ("create products", [
+        # Source of truth for the fast-changing product fields; the rest lives in ChromaDB
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id TEXT PRIMARY KEY,
+            price REAL,
+            stock INTEGER,
+            updated_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_updated_at
+        ON products (updated_at)
+        """
+    ]),
+]
+
+def migrate_sqlite_db(conn):
+    """Apply pending MIGRATIONS to an open connection; returns the names applied"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for number, (name, statements) in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(name)
+    return applied
+
+# Same default as the server's SQLite pool: EDUCATION_STORE_DB, or education_store.db next to this file
+EDUCATION_STORE_DB = os.path.abspath(os.getenv("EDUCATION_STORE_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "education_store.db"))
+
+def init_sqlite_db():
+    """Initialize SQLite database with required tables"""
+    conn = sqlite3.connect(EDUCATION_STORE_DB)
+    applied = migrate_sqlite_db(conn)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
     conn.close()
+    for name in applied:
+        print(f"🔧 Applied migration: {name}")
     print("✅ SQLite database initialized successfully!")
-    print("📊 Database file: education_store.db")
+    print(f"📊 Database file: {EDUCATION_STORE_DB} (schema version {version})")
 
-def init_chromadb():
-    """Initialize ChromaDB with product embeddings using default embedding function"""
+def compact_conversation_history(conn, retention_days: int = 30, batch_size: int = 500):
+    """Move sessions idle for more than retention_days into conversation_archive.
+    
+    Each stale session becomes one archive row holding its turns as a JSON
+    transcript, and its rows are deleted from the hot conversation_history
+    table. Works in batches of sessions, one transaction per batch.
+    Returns (sessions archived, turns archived).
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).isoformat(" ")
+    sessions_archived = 0
+    turns_archived = 0
+    
+    while True:
+        stale_sessions = conn.execute("""
+            SELECT user_id, session_id
+            FROM conversation_history
+            GROUP BY user_id, session_id
+            HAVING MAX(timestamp) < ?
+            LIMIT ?
+        """, (cutoff, batch_size)).fetchall()
+        if not stale_sessions:
+            break
+        
+        conn.execute("BEGIN")
+        try:
+            for user_id, session_id in stale_sessions:
+                turns = conn.execute("""
+                    SELECT user_message, assistant_response, timestamp
+                    FROM conversation_history
+                    WHERE user_id = ? AND session_id = ?
+                    ORDER BY timestamp
+                """, (user_id, session_id)).fetchall()
+                transcript = [
+                    {"user": user_message, "assistant": assistant_response, "timestamp": str(timestamp)}
+                    for user_message, assistant_response, timestamp in turns
+                ]
+                conn.execute("""
+                    INSERT INTO conversation_archive
+                    (user_id, session_id, turn_count, first_timestamp, last_timestamp, transcript)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (user_id, session_id, len(turns), turns[0][2], turns[-1][2], json.dumps(transcript, ensure_ascii=False)))
+                conn.execute(
+                    "DELETE FROM conversation_history WHERE user_id = ? AND session_id = ?",
+                    (user_id, session_id)
+                )
+                conn.execute(
+                    "DELETE FROM conversation_summaries WHERE user_id = ? AND session_id = ?",
+                    (user_id, session_id)
+                )
+                turns_archived += len(turns)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        sessions_archived += len(stale_sessions)
+    
+    return sessions_archived, turns_archived
+
+# Upper bound used for open-ended ranges such as "12+ years" or "All ages"
+MAX_AGE = 99
+
+def parse_age_range(age_range: str):
+    """Parse an age_range label into numeric (age_min, age_max), or None if it has no ages.
     
-    # Initialize ChromaDB client
-    client = chromadb.PersistentClient(path="./chroma_db")
+    "14-18 years" -> (14, 18), "12+ years" -> (12, 99), "All ages" -> (0, 99),
+    "Teacher" -> (18, 99).
+    """
+    text = (age_range or "").strip().lower()
+    match = re.match(r"(\d+)\s*(?:-|–|to)\s*(\d+)", text)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    match = re.match(r"(\d+)\s*\+", text)
+    if match:
+        return int(match.group(1)), MAX_AGE
+    if text.startswith("all"):
+        return 0, MAX_AGE
+    if text.startswith(("teacher", "adult")):
+        return 18, MAX_AGE
+    return None
+
+def iter_products(path: str):
+    """Yield product dicts from a CSV file with a header row, a JSON Lines file
+    (one product object per line) or a JSON file (a list, or {"products": [...]}).
+    
+    CSV and JSON Lines are read a row at a time; a JSON file is parsed whole.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                # Short rows leave their missing columns as None
+                yield {key.strip(): (value or "").strip() for key, value in row.items() if key}
+    elif path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8-sig") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from data["products"] if isinstance(data, dict) else data
+
+def product_document(product: dict) -> str:
+    """Text embedded for a product.
     
+    Only stable descriptive fields go in, so price and stock changes never
+    need re-embedding; their live values come from the products table.
+    Missing fields are left empty rather than failing the whole ingest.
+    """
+    fields = {key: product.get(key) or "" for key in ("product_name", "category", "description", "features", "age_range", "brand")}
+    return f"""
+        Product: {fields['product_name']}
+        Category: {fields['category']}
+        Description: {fields['description']}
+        Features: {fields['features']}
+        Age Range: {fields['age_range']}
+        Brand: {fields['brand']}
+        """
+
+def product_metadata(product: dict) -> dict:
+    """Chroma metadata for a product: typed price/stock, numeric age bounds, no empty values"""
+    metadata = {key: value for key, value in product.items() if value is not None and value != ""}
+    metadata['id'] = str(product['id'])
+    if 'price' in metadata:
+        metadata['price'] = float(metadata['price'])
+    if 'stock' in metadata:
+        metadata['stock'] = int(metadata['stock'])
+    # Numeric age bounds so queries can filter on age with a Chroma where clause
+    age_bounds = parse_age_range(product.get('age_range', ''))
+    if age_bounds:
+        metadata['age_min'], metadata['age_max'] = age_bounds
+    return metadata
+
+def _content_hash(value) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _product_record(product: dict):
+    """(id, document, metadata) for a product, with doc_hash/meta_hash added to the metadata"""
+    metadata = product_metadata(product)
+    document = product_document(product)
+    metadata['doc_hash'] = _content_hash(document)
+    metadata['meta_hash'] = _content_hash(metadata)
+    return metadata['id'], document, metadata
+
+def products_with_ids(products, first_row: int = 1):
+    """Pass products through, skipping (and reporting) rows that have no id; rows are numbered from first_row"""
+    for row_number, product in enumerate(products, first_row):
+        if product.get('id') in (None, ""):
+            print(f"⚠️ Skipping product row {row_number} ({product.get('product_name') or 'unnamed'}): no id")
+            continue
+        yield product
+
+def unique_products(products) -> list:
+    """Products that have an id, one per id: a repeated id keeps its last row, in the place of its first"""
+    latest = {}
+    for product in products_with_ids(products):
+        product_id = str(product['id'])
+        if product_id in latest:
+            print(f"⚠️ Duplicate product id {product_id}, keeping the last row")
+        latest[product_id] = product
+    return list(latest.values())
+
+def _stored_hashes(collection, page_size: int = 1000) -> dict:
+    """id -> (doc_hash, meta_hash) for everything in the collection, read a page at a time"""
+    hashes = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        for product_id, metadata in zip(page['ids'], page['metadatas']):
+            metadata = metadata or {}
+            hashes[product_id] = (metadata.get('doc_hash'), metadata.get('meta_hash'))
+        if len(page['ids']) < page_size:
+            return hashes
+        offset += page_size
+
+def bump_catalog_version(collection):
+    """Stamp the collection so running servers reload their catalog caches"""
+    # hnsw:* settings can't be passed to modify() again
+    metadata = {key: value for key, value in (collection.metadata or {}).items() if not key.startswith("hnsw:")}
+    metadata['catalog_version'] = datetime.utcnow().isoformat()
+    collection.modify(metadata=metadata)
+
+def sync_products(collection, products, batch_size: int = 500, delete_missing: bool = True) -> dict:
+    """Bring the collection in line with products, embedding only what changed.
+    
+    Each product's document text and metadata are hashed and the hashes
+    stored in its metadata. New products and products whose document
+    changed are upserted (and so re-embedded); products whose metadata
+    alone changed are updated without re-embedding; with delete_missing,
+    products no longer in the source are deleted. Writes go in batches of
+    batch_size. Returns counts per kind of change. products must have
+    unique ids (see unique_products).
+    """
+    stored = _stored_hashes(collection)
+    seen = set()
+    counts = {"added": 0, "reembedded": 0, "metadata_only": 0, "unchanged": 0, "deleted": 0}
+    upserts = []
+    updates = []
+    
+    def flush(force: bool = False):
+        if upserts and (force or len(upserts) >= batch_size):
+            collection.upsert(
+                ids=[item[0] for item in upserts],
+                documents=[item[1] for item in upserts],
+                metadatas=[item[2] for item in upserts]
+            )
+            upserts.clear()
+        if updates and (force or len(updates) >= batch_size):
+            collection.update(ids=[item[0] for item in updates], metadatas=[item[1] for item in updates])
+            updates.clear()
+    
+    for product in products:
+        product_id, document, metadata = _product_record(product)
+        if product_id in seen:
+            raise ValueError(f"Duplicate product id {product_id}")
+        seen.add(product_id)
+        
+        previous = stored.get(product_id)
+        if previous is None:
+            counts["added"] += 1
+            upserts.append((product_id, document, metadata))
+        elif previous[0] != metadata['doc_hash']:
+            counts["reembedded"] += 1
+            upserts.append((product_id, document, metadata))
+        elif previous[1] != metadata['meta_hash']:
+            counts["metadata_only"] += 1
+            updates.append((product_id, metadata))
+        else:
+            counts["unchanged"] += 1
+        flush()
+    flush(force=True)
+    
+    if delete_missing:
+        missing = [product_id for product_id in stored if product_id not in seen]
+        for start in range(0, len(missing), batch_size):
+            collection.delete(ids=missing[start:start + batch_size])
+        counts["deleted"] = len(missing)
+    
+    if counts["added"] or counts["reembedded"] or counts["metadata_only"] or counts["deleted"]:
+        bump_catalog_version(collection)
+    return counts
+
+UPSERT_INVENTORY_SQL = """
+    INSERT INTO products (id, price, stock, updated_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET price = excluded.price, stock = excluded.stock, updated_at = excluded.updated_at
+    WHERE products.price IS NOT excluded.price OR products.stock IS NOT excluded.stock
+"""
+
+def upsert_inventory(conn, rows):
+    """Write (id, price, stock) rows to the products table; unchanged rows keep their updated_at"""
+    now = datetime.utcnow().isoformat(" ")
+    with conn:
+        conn.executemany(UPSERT_INVENTORY_SQL, [(product_id, price, stock, now) for product_id, price, stock in rows])
+
+def update_inventory(conn, product_id: str, price=None, stock=None) -> bool:
+    """Change a product's price and/or stock; returns False if the product isn't in the table"""
+    with conn:
+        cursor = conn.execute(
+            "UPDATE products SET price = COALESCE(?, price), stock = COALESCE(?, stock), updated_at = ? WHERE id = ?",
+            (price, stock, datetime.utcnow().isoformat(" "), str(product_id))
+        )
+    return cursor.rowcount > 0
+
+def record_inventory(products, conn, batch_size: int = 500):
+    """Pass products through while writing their price and stock to the products table in batches"""
+    rows = []
+    for product in products:
+        price = product.get('price')
+        stock = product.get('stock')
+        rows.append((
+            str(product['id']),
+            float(price) if price not in (None, "") else None,
+            int(stock) if stock not in (None, "") else None
+        ))
+        if len(rows) >= batch_size:
+            upsert_inventory(conn, rows)
+            rows = []
+        yield product
+    if rows:
+        upsert_inventory(conn, rows)
+
+# Same default as the server's ChromaStore: CHROMA_DB_PATH, or chroma_db next to this file
+CHROMA_DB_PATH = os.path.abspath(os.getenv("CHROMA_DB_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"))
+
+def get_product_collection():
+    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     # Create collection with default embedding function (all-MiniLM-L6-v2)
-    collection = client.get_or_create_collection(
+    return client.get_or_create_collection(
         name="education_products",
         metadata={"description": "Education store products with embeddings"}
     )
+
+def ingest_products(path: str, batch_size: int = 500, delete_missing: bool = True):
+    """Sync the product collection and the products table with a CSV/JSON catalog file.
+    
+    Rows without an id are skipped, and a repeated id keeps its last row in
+    both stores, so the catalog is read whole before anything is written.
+    """
+    products = unique_products(iter_products(path))
+    conn = sqlite3.connect(EDUCATION_STORE_DB)
+    migrate_sqlite_db(conn)
+    products = record_inventory(products, conn, batch_size)
+    counts = sync_products(get_product_collection(), products, batch_size, delete_missing)
+    conn.close()
+    print_sync_counts(counts)
+    return counts
+
+# Set in each bulk-load worker process by _init_embedding_worker
+_worker_embedding_function = None
+
+def _init_embedding_worker():
+    """Load the embedding model once per bulk-load worker process"""
+    global _worker_embedding_function
+    from chromadb.utils import embedding_functions
+    _worker_embedding_function = embedding_functions.DefaultEmbeddingFunction()
+
+def _embed_documents(documents: list) -> list:
+    return [[float(value) for value in embedding] for embedding in _worker_embedding_function(documents)]
+
+def _read_checkpoint(checkpoint_path: str, source: dict) -> int:
+    """Products of source already loaded by an interrupted run, or 0"""
+    try:
+        with open(checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get("source") != source:
+        print(f"⚠️ {checkpoint_path} is for a different version of the catalog file, starting from the beginning")
+        return 0
+    return int(checkpoint.get("loaded", 0))
+
+def _write_checkpoint(checkpoint_path: str, source: dict, loaded: int):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "loaded": loaded}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def bulk_load_products(path: str, chunk_size: int = 1000, workers: int = None, embed_batch_size: int = 64,
+                       resume: bool = True) -> dict:
+    """Stream a large CSV/JSON Lines catalog into ChromaDB and the products table.
+    
+    Products are read from a generator and handled chunk_size at a time:
+    each chunk is checked against the stored hashes of just its own ids,
+    new and changed documents are embedded in batches of embed_batch_size
+    across a pool of worker processes, and the chunk is written to Chroma
+    with its precomputed embeddings while the next chunk embeds. At most
+    two chunks are held in memory, so peak memory doesn't grow with the
+    catalog. After every written chunk the number of products loaded is
+    saved to <path>.checkpoint, and a rerun on the same file skips that
+    many products (resume=False starts over). Unlike ingest, products
+    missing from the file are never deleted. Rows without an id are
+    skipped, and a repeated id ends up with its last row in both stores.
+    """
+    stat = os.stat(path)
+    source = {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+    checkpoint_path = path + ".checkpoint"
+    loaded = _read_checkpoint(checkpoint_path, source) if resume else 0
+    if loaded:
+        print(f"⏩ Resuming after {loaded} products already loaded")
+    
+    collection = get_product_collection()
+    conn = sqlite3.connect(EDUCATION_STORE_DB)
+    migrate_sqlite_db(conn)
+    workers = workers or os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        # spawn, not fork: the parent already holds Chroma/SQLite handles and threads
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_embedding_worker)
+    else:
+        _init_embedding_worker()
+    
+    counts = {"added": 0, "reembedded": 0, "metadata_only": 0, "unchanged": 0, "deleted": 0}
+    rows = itertools.islice(iter_products(path), loaded, None)
+    read = loaded
+    unwritten = {}  # id -> metadata of the chunk prepared but not yet written
+    pending = deque()
+    started = time.monotonic()
+    start_loaded = loaded
+    
+    def prepare(chunk, first_row):
+        nonlocal unwritten
+        records = {}
+        for product in record_inventory(products_with_ids(chunk, first_row), conn, chunk_size):
+            product_id, document, metadata = _product_record(product)
+            records[product_id] = (document, metadata)  # a repeated id within a chunk keeps the last
+        stored = collection.get(ids=list(records), include=["metadatas"])
+        stored = {product_id: metadata or {} for product_id, metadata in zip(stored['ids'], stored['metadatas'])}
+        # The previous chunk is written before this one, so compare against what it will leave behind
+        stored.update((product_id, unwritten[product_id]) for product_id in records if product_id in unwritten)
+        unwritten = {product_id: metadata for product_id, (_, metadata) in records.items()}
+        chunk_counts = dict.fromkeys(counts, 0)
+        upserts = []
+        updates = []
+        for product_id, (document, metadata) in records.items():
+            previous = stored.get(product_id)
+            if previous is None:
+                chunk_counts["added"] += 1
+                upserts.append((product_id, document, metadata))
+            elif previous.get('doc_hash') != metadata['doc_hash']:
+                chunk_counts["reembedded"] += 1
+                upserts.append((product_id, document, metadata))
+            elif previous.get('meta_hash') != metadata['meta_hash']:
+                chunk_counts["metadata_only"] += 1
+                updates.append((product_id, metadata))
+            else:
+                chunk_counts["unchanged"] += 1
+        documents = [item[1] for item in upserts]
+        batches = [documents[i:i + embed_batch_size] for i in range(0, len(documents), embed_batch_size)]
+        if pool:
+            embeddings = [pool.submit(_embed_documents, batch) for batch in batches]
+        else:
+            embeddings = [_embed_documents(batch) for batch in batches]
+        return len(chunk), chunk_counts, upserts, updates, embeddings
+    
+    def write(size, chunk_counts, upserts, updates, embeddings):
+        nonlocal loaded
+        if upserts:
+            collection.upsert(
+                ids=[item[0] for item in upserts],
+                embeddings=[vector for batch in embeddings for vector in (batch.result() if pool else batch)],
+                documents=[item[1] for item in upserts],
+                metadatas=[item[2] for item in upserts]
+            )
+        if updates:
+            collection.update(ids=[item[0] for item in updates], metadatas=[item[1] for item in updates])
+        loaded += size
+        for kind, count in chunk_counts.items():
+            counts[kind] += count
+        _write_checkpoint(checkpoint_path, source, loaded)
+        rate = (loaded - start_loaded) / max(time.monotonic() - started, 1e-9)
+        print(f"📦 {loaded} products loaded ({rate:.0f}/s): {counts['added']} added, "
+              f"{counts['reembedded']} re-embedded, {counts['metadata_only']} metadata-only, {counts['unchanged']} unchanged")
+    
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            pending.append(prepare(chunk, read + 1))
+            read += len(chunk)
+            if len(pending) > 1:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        conn.close()
+    
+    if counts["added"] or counts["reembedded"] or counts["metadata_only"]:
+        bump_catalog_version(collection)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print_sync_counts(counts)
+    return counts
+
+def print_sync_counts(counts: dict):
+    print(f"✅ Catalog synced: {counts['added']} added, {counts['reembedded']} re-embedded, "
+          f"{counts['metadata_only']} metadata-only updates, {counts['deleted']} deleted, {counts['unchanged']} unchanged")
+
+def init_chromadb():
+    """Initialize ChromaDB with product embeddings using default embedding function"""
+    
+    # Initialize ChromaDB client and collection
+    collection = get_product_collection()
     
     # 50 Detailed Educational Products
     products = [
@@ -610,43 +1156,64 @@ def init_chromadb():
         }
     ]
     
-        # Add all products to ChromaDB
-    documents = []
-    metadatas = []
-    ids = []
-    
-    for product in products:
-        # Create a comprehensive document for embedding
-        doc_text = f"""
-        Product: {product['product_name']}
-        Category: {product['category']}
-        Description: {product['description']}
-        Features: {product['features']}
-        Age Range: {product['age_range']}
-        Brand: {product['brand']}
-        Price: ${product['price']}
-        Stock: {product['stock']} units
-        """
-        
-        documents.append(doc_text)
-        metadatas.append(product)
-        ids.append(product['id'])
+    # Sync the collection with the products, and their price/stock into SQLite; re-running only touches what changed.
+    # Products added by ingest/bulk-load aren't in this list, so nothing is deleted.
+    conn = sqlite3.connect(EDUCATION_STORE_DB)
+    migrate_sqlite_db(conn)
+    counts = sync_products(collection, record_inventory(unique_products(products), conn), delete_missing=False)
+    conn.close()
+    print_sync_counts(counts)
+    print(f"📊 Vector database: {CHROMA_DB_PATH}")
     
-    # Add to ChromaDB collection
-    if documents:
-        collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
-        print(f"✅ ChromaDB initialized with {len(documents)} products!")
-        print("📊 Vector database: ./chroma_db")
-        
-        # Verify the count
-        count = collection.count()
-        print(f"📈 Total products in vector store: {count}")
-    else:
-        print("⚠️ No products added to ChromaDB")
+    # Verify the count
+    count = collection.count()
+    print(f"📈 Total products in vector store: {count}")
 
 if __name__ == "__main__":
-    init_databases()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="EduSmart Store database tools")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("init", help="create/migrate SQLite and load products into ChromaDB (default)")
+    subparsers.add_parser("migrate", help="apply pending SQLite schema migrations only")
+    compact_parser = subparsers.add_parser("compact", help="archive idle sessions out of conversation_history")
+    compact_parser.add_argument("--days", type=int, default=30, help="archive sessions idle for more than this many days")
+    ingest_parser = subparsers.add_parser("ingest", help="sync ChromaDB with a CSV/JSON product catalog, embedding only changed products")
+    ingest_parser.add_argument("path", help="catalog file (.csv or .json)")
+    ingest_parser.add_argument("--batch-size", type=int, default=500, help="products per write")
+    ingest_parser.add_argument("--keep-missing", action="store_true", help="don't delete products absent from the file")
+    bulk_parser = subparsers.add_parser("bulk-load", help="stream a large CSV/JSON Lines catalog into ChromaDB with parallel, resumable embedding")
+    bulk_parser.add_argument("path", help="catalog file (.csv, .jsonl or .json)")
+    bulk_parser.add_argument("--chunk-size", type=int, default=1000, help="products read, embedded and written per chunk")
+    bulk_parser.add_argument("--workers", type=int, default=None, help="embedding processes (default: CPU count, 1 embeds in-process)")
+    bulk_parser.add_argument("--embed-batch-size", type=int, default=64, help="documents per embedding task")
+    bulk_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted run")
+    inventory_parser = subparsers.add_parser("inventory", help="update a product's price and/or stock (no re-embedding)")
+    inventory_parser.add_argument("product_id")
+    inventory_parser.add_argument("--price", type=float)
+    inventory_parser.add_argument("--stock", type=int)
+    args = parser.parse_args()
+    
+    if args.command == "migrate":
+        init_sqlite_db()
+    elif args.command == "compact":
+        conn = sqlite3.connect(EDUCATION_STORE_DB)
+        migrate_sqlite_db(conn)
+        sessions, turns = compact_conversation_history(conn, args.days)
+        conn.close()
+        print(f"🗄️ Archived {sessions} sessions ({turns} turns) idle for more than {args.days} days")
+    elif args.command == "ingest":
+        ingest_products(args.path, args.batch_size, not args.keep_missing)
+    elif args.command == "bulk-load":
+        bulk_load_products(args.path, args.chunk_size, args.workers, args.embed_batch_size, not args.restart)
+    elif args.command == "inventory":
+        if args.price is None and args.stock is None:
+            parser.error("inventory needs --price and/or --stock")
+        conn = sqlite3.connect(EDUCATION_STORE_DB)
+        migrate_sqlite_db(conn)
+        updated = update_inventory(conn, args.product_id, args.price, args.stock)
+        conn.close()
+        if updated:
+            print(f"✅ Updated product {args.product_id}")
+        else:
+            print(f"⚠️ Product {args.product_id} not found in the products table (run init or ingest first)")
+    else:
+        init_databases()
\ No newline at end of file
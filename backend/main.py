@@ -1,21 +1,44 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
 import os
 import sqlite3
 import chromadb
 import uuid
+import asyncio
+import functools
+import json
+import time
+import hashlib
+import inspect
+import math
+import random
+import threading
+import queue
+import shutil
+import subprocess
+import wave
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 import logging
+import re
 import base64
+import urllib.parse
 from gtts import gTTS
+from gtts.tts import gTTSError
 import io
 import tempfile
 from typing import Optional
 from dotenv import load_dotenv
+import numpy as np
+from chromadb.utils import embedding_functions
+from init_database import MAX_AGE, migrate_sqlite_db, compact_conversation_history, parse_age_range
 
 # LangChain imports (compatible versions)
 try:
@@ -28,6 +51,23 @@ except ImportError as e:
     ChatGoogleGenerativeAI = None
     HumanMessage = None
 
+# Pooled keep-alive HTTP for gTTS; without httpx, gTTS opens its own connection per call
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401 (lets httpx negotiate HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# PooledGTTS builds on this private gTTS method (present in the pinned 2.5.x releases)
+GTTS_POOLABLE = hasattr(gTTS, "_prepare_requests")
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -45,18 +85,45 @@ app.add_middleware(
 
 # Configure Gemini
 gemini_api_key = os.getenv("GEMINI_API_KEY")
+# The Gemini SDK manages its own connection rather than sharing the httpx pool below. It is
+# created once and keeps that connection open: with the default grpc transport one long-lived
+# HTTP/2 channel, with "rest" a keep-alive session.
+gemini_transport = os.getenv("GEMINI_TRANSPORT") or None
+gemini_timeout = float(os.getenv("GEMINI_TIMEOUT")) if os.getenv("GEMINI_TIMEOUT") else None
+
+def supported_kwargs(target, kwargs: dict, fields) -> dict:
+    """kwargs the installed SDK accepts; older pinned versions lack some, which are dropped with a warning"""
+    unsupported = [key for key in kwargs if key not in fields]
+    if unsupported:
+        logger.warning(f"{target} doesn't support {', '.join(unsupported)} in this version, ignoring")
+    return {key: value for key, value in kwargs.items() if key in fields}
+
+gemini_client_kwargs = {key: value for key, value in (("transport", gemini_transport), ("timeout", gemini_timeout)) if value is not None}
+gemini_configure_kwargs = {"transport": gemini_transport} if gemini_transport else {}
+# Per-request options for the direct google.generativeai calls
+gemini_request_kwargs = {}
 if gemini_api_key and LANGCHAIN_AVAILABLE:
-    genai.configure(api_key=gemini_api_key)
-    # Initialize LangChain Gemini
+    genai.configure(api_key=gemini_api_key, **gemini_configure_kwargs)
+    # Initialize LangChain Gemini (transport/timeout need a newer langchain-google-genai than the pinned 0.0.2)
     llm = ChatGoogleGenerativeAI(
         model="gemini-2.5-flash",
         google_api_key=gemini_api_key,
-        temperature=0.7
+        temperature=0.7,
+        **supported_kwargs(
+            "ChatGoogleGenerativeAI", gemini_client_kwargs,
+            getattr(ChatGoogleGenerativeAI, "model_fields", None) or ChatGoogleGenerativeAI.__fields__
+        )
     )
 else:
     if gemini_api_key and not LANGCHAIN_AVAILABLE:
         logger.warning("LangChain not available, using direct Gemini API")
-        genai.configure(api_key=gemini_api_key)
+        genai.configure(api_key=gemini_api_key, **gemini_configure_kwargs)
+        # request_options needs a newer google-generativeai than the pinned 0.3.0
+        gemini_request_kwargs = supported_kwargs(
+            "GenerativeModel.generate_content",
+            {"request_options": {"timeout": gemini_timeout}} if gemini_timeout else {},
+            inspect.signature(genai.GenerativeModel.generate_content).parameters
+        )
         model = genai.GenerativeModel('gemini-pro')
     else:
         logger.warning("GEMINI_API_KEY not found or LangChain unavailable. AI features will be disabled.")
@@ -72,29 +139,397 @@ class UserMessage(BaseModel):
 
 class AssistantResponse(BaseModel):
     text: str
-    audio_data: Optional[str] = None
+    audio_data: Optional[str] = None  # deprecated, audio is served from audio_url
+    audio_url: Optional[str] = None
     session_id: str
     response_type: str
     timestamp: str
 
+DEMO_MESSAGES = {
+    "en": "I'm here to help with education store products! Currently running in demo mode. Please configure GEMINI_API_KEY for AI responses.",
+    "km": "ខ្ញុំនៅទីនេះដើម្បីជួយអ្នកជាមួយផលិតផលហាងអប់រំ! បច្ចុប្បន្នដំណើរការក្នុងរបៀបសាកល្បង។ សូមកំណត់ GEMINI_API_KEY សម្រាប់ការឆ្លើយតប AI។"
+}
+
+ERROR_MESSAGES = {
+    "en": "I apologize, but I'm having trouble processing your request right now. Please try again in a moment.",
+    "km": "សូមអភ័យទោស ខ្ញុំមានបញ្ហាក្នុងការដំណើរការសំណើរបស់អ្នកឥឡូវនេះ។ សូមព្យាយាមម្តងទៀត។"
+}
+
+class TTSAudioCache:
+    """Content-addressed cache of synthesized audio keyed by (cleaned text, language).
+    
+    Entries live in an in-memory LRU bounded by total bytes; when cache_dir
+    is set, every entry is also written to disk so evicted or pre-warmed
+    audio survives restarts.
+    """
+    
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, cache_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def make_key(clean_text: str, lang: str) -> str:
+        return hashlib.sha256(f"{lang}\n{clean_text}".encode("utf-8")).hexdigest()
+    
+    def get(self, key: str, record: bool = True) -> Optional[bytes]:
+        """Look up audio by key; record=False serves playback without touching hit counters"""
+        with self.lock:
+            audio_bytes = self.entries.get(key)
+            if audio_bytes is not None:
+                self.entries.move_to_end(key)
+                if record:
+                    self.hits += 1
+                return audio_bytes
+        
+        audio_bytes = self._read_disk(key)
+        with self.lock:
+            if audio_bytes is None:
+                if record:
+                    self.misses += 1
+                return None
+            if record:
+                self.disk_hits += 1
+            self._store_memory(key, audio_bytes)
+        return audio_bytes
+    
+    def put(self, key: str, audio_bytes: bytes):
+        with self.lock:
+            self._store_memory(key, audio_bytes)
+        self._write_disk(key, audio_bytes)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_tier": bool(self.cache_dir)
+            }
+    
+    def _store_memory(self, key: str, audio_bytes: bytes):
+        # Caller holds self.lock
+        if len(audio_bytes) > self.max_bytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= len(previous)
+        self.entries[key] = audio_bytes
+        self.current_bytes += len(audio_bytes)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp3")
+    
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"TTS cache read failed: {e}")
+            return None
+    
+    def _write_disk(self, key: str, audio_bytes: bytes):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so readers never see a partial MP3
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio_bytes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"TTS cache write failed: {e}")
+
+class PooledHTTPClient:
+    """Keep-alive connection pool shared by the app's outbound HTTP calls.
+    
+    Wraps one thread-safe httpx.Client, so repeated gTTS requests reuse warm
+    TLS connections instead of the fresh requests.Session gTTS opens for
+    every call. HTTP/2 is negotiated when the h2 package is installed and
+    http2 is on; otherwise connections are HTTP/1.1 keep-alive.
+    """
+    
+    def __init__(self, max_connections: int = 20, max_keepalive: int = 10, keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 5.0, read_timeout: float = 20.0, http2: bool = True):
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.client = httpx.Client(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+        self.stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+    
+    def post(self, url: str, **kwargs):
+        with self.stats_lock:
+            self.requests += 1
+        try:
+            return self.client.post(url, **kwargs)
+        except httpx.HTTPError:
+            with self.stats_lock:
+                self.errors += 1
+            raise
+    
+    def close(self):
+        self.client.close()
+    
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {"http2": self.http2, "requests": self.requests, "errors": self.errors}
+
+class PooledGTTS(gTTS):
+    """gTTS whose requests go through a PooledHTTPClient.
+    
+    base_url, when set, replaces the scheme and host of Google's endpoint
+    (e.g. a local stand-in server for tests). The response parsing mirrors
+    gTTS.stream() as of the pinned gTTS release; it relies on the private
+    _prepare_requests(), so a gTTS without it falls back to the stock
+    stream() and its own session.
+    """
+    
+    AUDIO_PATTERN = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+    
+    def __init__(self, *args, http_client: PooledHTTPClient, base_url: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http_client = http_client
+        self.base_url = base_url
+    
+    def stream(self):
+        if not GTTS_POOLABLE:
+            yield from super().stream()
+            return
+        for request in self._prepare_requests():
+            url = request.url
+            if self.base_url:
+                parts = urllib.parse.urlsplit(url)
+                url = self.base_url.rstrip("/") + urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+            headers = {name: value for name, value in request.headers.items() if name.lower() != "content-length"}
+            try:
+                response = self.http_client.post(url, content=request.body, headers=headers)
+            except httpx.HTTPError as e:
+                raise gTTSError(f"Failed to connect to TTS API: {e}")
+            if response.status_code >= 400:
+                raise gTTSError(f"{response.status_code} ({response.reason_phrase}) from TTS API")
+            found = False
+            for line in response.iter_lines():
+                if "jQ1olc" in line:
+                    match = self.AUDIO_PATTERN.search(line)
+                    if not match:
+                        raise gTTSError("No audio stream in TTS API response")
+                    found = True
+                    yield base64.b64decode(match.group(1).encode("ascii"))
+            if not found:
+                raise gTTSError("No audio stream in TTS API response")
+
+class TTSBackend(ABC):
+    """One speech engine: turns cleaned text into audio bytes for the languages it supports"""
+    
+    name = ""
+    media_type = "audio/mpeg"
+    
+    def supports(self, lang: str) -> bool:
+        return True
+    
+    @abstractmethod
+    def synthesize(self, text: str, lang: str) -> bytes:
+        """Audio bytes for text; raises on failure"""
+    
+    def join(self, segments) -> bytes:
+        """Audio for consecutive segments played as one; MP3 frames simply concatenate"""
+        return b"".join(segments)
+
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS (MP3) over the network, through the shared HTTP pool when there is one"""
+    
+    name = "gtts"
+    
+    def __init__(self, http_client: Optional[PooledHTTPClient] = None, base_url: Optional[str] = None):
+        self.http_client = http_client
+        self.base_url = base_url
+    
+    def synthesize(self, text: str, lang: str) -> bytes:
+        if self.http_client:
+            tts = PooledGTTS(text=text, lang=lang, slow=False, http_client=self.http_client, base_url=self.base_url)
+        else:
+            tts = gTTS(text=text, lang=lang, slow=False)
+        audio_buffer = io.BytesIO()
+        tts.write_to_fp(audio_buffer)
+        return audio_buffer.getvalue()
+
+class EspeakBackend(TTSBackend):
+    """Offline, CPU-only synthesis (WAV) with the espeak-ng command line tool.
+    
+    Sounds more robotic than gTTS but needs no network. espeak-ng has no
+    Khmer voice, so a language is only supported when voices maps it to one
+    and the executable is on the PATH.
+    """
+    
+    name = "espeak"
+    media_type = "audio/wav"
+    
+    def __init__(self, executable: str = "espeak-ng", voices: Optional[dict] = None, speed: int = 160, timeout: float = 20.0):
+        self.executable = shutil.which(executable)
+        self.voices = voices if voices is not None else {"en": "en-us"}
+        self.speed = speed
+        self.timeout = timeout
+    
+    def supports(self, lang: str) -> bool:
+        return self.executable is not None and lang in self.voices
+    
+    def synthesize(self, text: str, lang: str) -> bytes:
+        result = subprocess.run(
+            [self.executable, "--stdout", "--stdin", "-v", self.voices[lang], "-s", str(self.speed)],
+            input=text.encode("utf-8"),
+            capture_output=True,
+            timeout=self.timeout,
+            check=True
+        )
+        if not result.stdout.startswith(b"RIFF"):
+            raise RuntimeError(f"espeak-ng returned no audio: {result.stderr.decode('utf-8', 'replace').strip()}")
+        # Written to a pipe, the WAV header carries placeholder sizes; rewriting it fixes them
+        return self.join([result.stdout])
+    
+    def join(self, segments) -> bytes:
+        output = io.BytesIO()
+        with wave.open(output, "wb") as joined:
+            for index, segment in enumerate(segments):
+                with wave.open(io.BytesIO(segment), "rb") as part:
+                    if index == 0:
+                        joined.setparams(part.getparams())
+                    joined.writeframes(part.readframes(part.getnframes()))
+        return output.getvalue()
+
 class TextToSpeechService:
-    def __init__(self):
+    # A sentence ends at ., !, ? or the Khmer khan/bariyoosan followed by whitespace, or at a line break
+    SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?\u17d4\u17d5])\s+|\n+')
+    
+    def __init__(self, http_client: Optional[PooledHTTPClient] = None):
         self.temp_dir = tempfile.gettempdir()
+        self.backends = self._select_backends(http_client)
+        self.cache = TTSAudioCache(
+            max_bytes=int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            # The disk tier is on by default so /audio URLs outlive memory eviction
+            cache_dir=os.getenv("TTS_CACHE_DIR", os.path.join(self.temp_dir, "edusmart_tts_cache")) or None
+        )
+    
+    @staticmethod
+    def _select_backends(http_client: Optional[PooledHTTPClient]) -> dict:
+        """Backend per language from TTS_BACKEND / TTS_BACKEND_EN / TTS_BACKEND_KM, falling back to gTTS"""
+        gtts_backend = GTTSBackend(http_client, os.getenv("GTTS_BASE_URL") or None)
+        espeak_voices = {"en": os.getenv("TTS_ESPEAK_VOICE_EN", "en-us"), "km": os.getenv("TTS_ESPEAK_VOICE_KM", "")}
+        available = {
+            "gtts": gtts_backend,
+            "espeak": EspeakBackend(
+                os.getenv("ESPEAK_NG_PATH", "espeak-ng"),
+                voices={lang: voice for lang, voice in espeak_voices.items() if voice}
+            )
+        }
+        default = os.getenv("TTS_BACKEND", "gtts")
+        backends = {}
+        for lang in ("en", "km"):
+            name = os.getenv(f"TTS_BACKEND_{lang.upper()}", default)
+            backend = available.get(name)
+            if backend is None or not backend.supports(lang):
+                logger.warning(f"TTS backend {name!r} is not available for {lang}, using gtts")
+                backend = gtts_backend
+            backends[lang] = backend
+        logger.info(f"TTS backends: {', '.join(f'{lang}={backend.name}' for lang, backend in backends.items())}")
+        return backends
+    
+    def backend(self, lang: str = 'en') -> TTSBackend:
+        return self.backends['km' if lang == 'km' else 'en']
+    
+    def _cache_key(self, clean_text: str, tts_lang: str) -> str:
+        # gTTS keeps the original keys so existing cached audio stays valid
+        backend = self.backend(tts_lang)
+        return self.cache.make_key(clean_text, tts_lang if backend.name == "gtts" else f"{tts_lang}|{backend.name}")
+    
+    def audio_id(self, text: str, lang: str = 'en') -> Optional[str]:
+        """Content address of the audio for text, or None if there is nothing to say"""
+        clean_text = self.clean_text_for_speech(text)
+        if not clean_text:
+            return None
+        return self._cache_key(clean_text, 'km' if lang == 'km' else 'en')
     
-    def text_to_speech(self, text: str, lang: str = 'en') -> Optional[str]:
+    def synthesize(self, text: str, lang: str = 'en') -> Optional[bytes]:
+        """Return audio bytes (MP3 or WAV, see audio_media_type) for text, or None if there is nothing to say or synthesis fails"""
         try:
             clean_text = self.clean_text_for_speech(text)
+            if not clean_text:
+                return None
             tts_lang = 'km' if lang == 'km' else 'en'
-            tts = gTTS(text=clean_text, lang=tts_lang, slow=False)
-            audio_buffer = io.BytesIO()
-            tts.write_to_fp(audio_buffer)
-            audio_buffer.seek(0)
-            audio_base64 = base64.b64encode(audio_buffer.read()).decode('utf-8')
-            return audio_base64
+            cache_key = self._cache_key(clean_text, tts_lang)
+            audio_bytes = self.cache.get(cache_key)
+            if audio_bytes is not None:
+                return audio_bytes
+            
+            audio_bytes = self.backend(tts_lang).synthesize(clean_text, tts_lang)
+            self.cache.put(cache_key, audio_bytes)
+            return audio_bytes
         except Exception as e:
             logger.error(f"TTS Error: {e}")
             return None
     
+    def prewarm(self, messages):
+        """Synthesize (text, lang) pairs ahead of time so they are served from the cache"""
+        for text, lang in messages:
+            self.synthesize(text, lang)
+        logger.info(f"TTS cache pre-warmed: {self.cache.stats()}")
+    
+    def synthesize_to_id(self, text: str, lang: str = 'en') -> Optional[str]:
+        """Synthesize (or reuse) audio for text and return its id for /audio/{id}"""
+        if self.synthesize(text, lang) is None:
+            return None
+        return self.audio_id(text, lang)
+    
+    def join_audio(self, text: str, lang: str, audio_ids) -> Optional[str]:
+        """Join segment audio into the audio for the full text and return its id.
+        
+        audio_ids holds None for segments whose synthesis failed. The joined
+        clip is cached under the full text's content address, so a partial
+        join would be replayed for every identical reply; in that case the
+        full text is synthesized directly instead.
+        """
+        if not audio_ids:
+            return None
+        segments = [self.get_audio(audio_id) if audio_id else None for audio_id in audio_ids]
+        if any(segment is None for segment in segments):
+            return self.synthesize_to_id(text, lang)
+        audio_id = self.audio_id(text, lang)
+        self.cache.put(audio_id, self.backend(lang).join(segments))
+        return audio_id
+    
+    def get_audio(self, audio_id: str) -> Optional[bytes]:
+        return self.cache.get(audio_id, record=False)
+    
     def clean_text_for_speech(self, text: str) -> str:
         import re
         clean_text = re.sub(r'[**]', '', text)
@@ -104,99 +539,1430 @@ class TextToSpeechService:
         clean_text = re.sub(r'\n+', '. ', clean_text)
         clean_text = re.sub(r'\s+', ' ', clean_text)
         return clean_text.strip()
+    
+    def split_sentences(self, text: str):
+        """Split raw text into complete sentences and the unfinished remainder"""
+        parts = self.SENTENCE_BOUNDARY.split(text)
+        return [part for part in parts[:-1] if part.strip()], parts[-1]
+
+class SentenceAudioPipeline:
+    """Synthesizes a streamed reply sentence by sentence while the LLM is still generating.
+    
+    Text deltas are fed in as they arrive; every time enough complete
+    sentences have accumulated they are sent to gTTS on the RAG executor.
+    Segments are handed out as /audio ids strictly in reply order.
+    """
+    
+    def __init__(self, tts_service: TextToSpeechService, language: str, run_blocking, min_chars: int = 40):
+        self.tts_service = tts_service
+        self.language = language
+        self.run_blocking = run_blocking
+        self.min_chars = min_chars
+        self.pending_text = ""
+        self.sentences = []
+        self.tasks = []
+        self.next_index = 0
+    
+    def feed(self, delta: str):
+        self.pending_text += delta
+        sentences, self.pending_text = self.tts_service.split_sentences(self.pending_text)
+        for sentence in sentences:
+            self.sentences.append(sentence)
+            # Newline-joined so clean_text_for_speech keeps a pause between sentences
+            chunk = "\n".join(self.sentences)
+            if len(self.tts_service.clean_text_for_speech(chunk)) >= self.min_chars:
+                self._submit(chunk)
+                self.sentences = []
+    
+    def close(self):
+        """Flush whatever text is left once generation has finished"""
+        chunk = "\n".join(self.sentences + [self.pending_text])
+        self.sentences, self.pending_text = [], ""
+        if self.tts_service.clean_text_for_speech(chunk):
+            self._submit(chunk)
+    
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+    
+    def _submit(self, chunk: str):
+        self.tasks.append(asyncio.ensure_future(
+            self.run_blocking(self.tts_service.synthesize_to_id, chunk, self.language)
+        ))
+    
+    def ready_segments(self):
+        """Yield (index, audio id) for segments already synthesized, without waiting"""
+        while self.next_index < len(self.tasks) and self.tasks[self.next_index].done():
+            yield from self._take(self.tasks[self.next_index].result())
+    
+    async def remaining_segments(self):
+        """Yield every segment not handed out yet, waiting for each in order"""
+        while self.next_index < len(self.tasks):
+            audio_id = await self.tasks[self.next_index]
+            for segment in self._take(audio_id):
+                yield segment
+    
+    async def collect(self):
+        """Wait for all segments and return their audio ids in order, None for failed ones"""
+        audio_ids = []
+        while self.next_index < len(self.tasks):
+            audio_ids.append(await self.tasks[self.next_index])
+            self.next_index += 1
+        return audio_ids
+    
+    def _take(self, audio_id: Optional[str]):
+        index = self.next_index
+        self.next_index += 1
+        if audio_id:
+            yield index, audio_id
+
+class SQLiteConnectionPool:
+    """Queue-based pool of SQLite connections shared by all request threads.
+    
+    Connections are opened lazily up to `size`, switched to WAL journaling
+    with synchronous=NORMAL so readers never wait on the writer and commits
+    skip the per-transaction fsync, and given a busy timeout so concurrent
+    writers queue instead of failing with "database is locked". Because
+    connections are reused, sqlite3's per-connection statement cache keeps
+    the conversation queries prepared between calls.
+    """
+    
+    def __init__(self, db_path: str, size: int = 8, busy_timeout_ms: int = 5000, cached_statements: int = 128):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        return conn
+    
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self.created -= 1
+                    raise
+        return self.idle.get(timeout=self.busy_timeout_ms / 1000)
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; use `with conn:` inside for a transaction"""
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.ProgrammingError:
+            # Usually SQL misuse on a healthy connection; only replace one that no longer answers
+            if not self._usable(conn):
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn)
+    
+    @staticmethod
+    def _usable(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def _release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self.idle.put(conn)
+    
+    def _discard(self, conn: sqlite3.Connection):
+        """Close a broken connection and free its slot, so the next acquire opens a new one"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self.lock:
+            self.created -= 1
+    
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.created -= 1
+
+INSERT_CONVERSATION_SQL = """
+    INSERT INTO conversation_history 
+    (user_id, session_id, user_message, assistant_response, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+SELECT_HISTORY_SQL = """
+    SELECT user_message, assistant_response, timestamp 
+    FROM conversation_history 
+    WHERE user_id = ? AND session_id = ? 
+    ORDER BY timestamp DESC 
+    LIMIT ?
+"""
+
+SELECT_SUMMARY_SQL = """
+    SELECT summary, turn_count 
+    FROM conversation_summaries 
+    WHERE user_id = ? AND session_id = ?
+"""
+
+UPSERT_SUMMARY_SQL = """
+    INSERT INTO conversation_summaries 
+    (user_id, session_id, summary, turn_count, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, session_id) DO UPDATE SET 
+    summary = excluded.summary, turn_count = excluded.turn_count, updated_at = excluded.updated_at
+"""
+
+class SessionHistoryCache:
+    """Recent turns per session held in memory, newest first.
+    
+    Each session keeps a ring buffer of at most max_turns turns. Sessions
+    are evicted least-recently-used first when there are more than
+    max_sessions of them or their text exceeds max_bytes, and dropped once
+    idle for ttl seconds. A session's entry is only ever created from a
+    full load of its recent history, so a cached entry is authoritative for
+    any limit up to max_turns.
+    """
+    
+    def __init__(self, max_turns: int = 10, max_sessions: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 1800):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sessions = OrderedDict()  # key -> [turns deque (oldest first), bytes, last access]
+        self.loading = {}  # key -> token of a load in flight
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, limit: int):
+        """Newest-first turns for a cached session, or None on a miss"""
+        with self.lock:
+            self._expire()
+            entry = self.sessions.get(key)
+            if entry is None or limit > self.max_turns:
+                self.misses += 1
+                return None
+            entry[2] = time.monotonic()
+            self.sessions.move_to_end(key)
+            self.hits += 1
+            turns = list(entry[0])
+        turns.reverse()
+        return turns[:limit]
+    
+    def begin_load(self, key) -> object:
+        token = object()
+        with self.lock:
+            self.loading[key] = token
+        return token
+    
+    def finish_load(self, key, token, turns):
+        """Cache newest-first turns loaded from storage, unless a write raced with the load"""
+        with self.lock:
+            if self.loading.get(key) is not token:
+                return
+            del self.loading[key]
+            ring = deque(reversed(turns[:self.max_turns]), maxlen=self.max_turns)
+            self._drop(key)
+            self.sessions[key] = [ring, sum(self._turn_bytes(turn) for turn in ring), time.monotonic()]
+            self.current_bytes += self.sessions[key][1]
+            self._evict()
+    
+    def append(self, key, turn):
+        """Write-through for a newly stored turn"""
+        with self.lock:
+            # A load in flight may have missed this turn, so don't let it populate the cache
+            self.loading.pop(key, None)
+            entry = self.sessions.get(key)
+            if entry is None:
+                return
+            ring = entry[0]
+            if len(ring) == ring.maxlen:
+                entry[1] -= self._turn_bytes(ring[0])
+                self.current_bytes -= self._turn_bytes(ring[0])
+            ring.append(turn)
+            entry[1] += self._turn_bytes(turn)
+            entry[2] = time.monotonic()
+            self.current_bytes += self._turn_bytes(turn)
+            self.sessions.move_to_end(key)
+            self._evict()
+    
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self.sessions),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions
+            }
+    
+    def _turn_bytes(self, turn) -> int:
+        return sum(len(text.encode("utf-8")) for text in turn if text)
+    
+    def _drop(self, key):
+        # Caller holds self.lock
+        entry = self.sessions.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+    
+    def _expire(self):
+        # Caller holds self.lock; entries are in access order, so expired ones are at the front
+        cutoff = time.monotonic() - self.ttl
+        while self.sessions:
+            key, entry = next(iter(self.sessions.items()))
+            if entry[2] >= cutoff:
+                break
+            self._drop(key)
+            self.evictions += 1
+    
+    def _evict(self):
+        # Caller holds self.lock
+        self._expire()
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.current_bytes > self.max_bytes):
+            self._drop(next(iter(self.sessions)))
+            self.evictions += 1
 
 class ConversationMemory:
-    def __init__(self):
+    """Conversation turns in SQLite, optionally written behind the request path.
+    
+    In write-behind mode store_conversation only appends to an in-process
+    buffer; a background thread flushes it with executemany in one
+    transaction once flush_size turns are pending or flush_interval seconds
+    have passed. Reads merge the unflushed buffer so a session always sees
+    its own latest turns. With a session_cache, reads are served from
+    memory and stores write through to it. While flushes fail the flusher
+    retries with jittered exponential backoff up to backoff_max seconds,
+    and once more than max_pending turns are buffered the oldest are
+    dropped.
+    
+    Each session also has a rolling summary, one short extractive line per
+    turn (newest last, at most summary_lines of them), updated as turns are
+    stored and persisted in conversation_summaries together with the rows.
+    The prompt builder uses it in place of turns too old to include verbatim.
+    """
+    
+    def __init__(self, pool: SQLiteConnectionPool, write_behind: bool = True, flush_size: int = 50, flush_interval: float = 0.5,
+                 session_cache: Optional[SessionHistoryCache] = None, summary_lines: int = 20,
+                 max_pending: int = 10000, backoff_max: float = 30.0):
         self.max_history = 10
+        self.summary_lines = summary_lines
+        self.summaries = OrderedDict()  # (user_id, session_id) -> (lines, turn count), most recently used last
+        self.max_cached_summaries = 10000
+        self.summary_lock = threading.Lock()
+        self.summary_update_lock = threading.Lock()
+        self.pending_summaries = {}  # key -> (lines, turn count) not yet flushed
+        self.pool = pool
+        self.session_cache = session_cache
+        self.write_behind = write_behind
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.backoff_max = backoff_max
+        self.pending = []
+        self.pending_cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.stopping = False
+        self.flushed_rows = 0
+        self.flush_batches = 0
+        self.flush_failures = 0
+        self.consecutive_failures = 0
+        self.dropped_rows = 0
+        self.flusher = None
+        if self.write_behind:
+            self.flusher = threading.Thread(target=self._flush_loop, name="conversation-flusher", daemon=True)
+            self.flusher.start()
     
     def store_conversation(self, user_id: str, session_id: str, user_message: str, assistant_response: str):
-        try:
-            conn = get_db_connection()
-            if conn is None:
-                logger.warning("No database connection. Skipping conversation storage.")
+        # Stored as text in the same format sqlite3's datetime adapter used, so ORDER BY stays chronological
+        row = (user_id, session_id, user_message, assistant_response, datetime.utcnow().isoformat(" "))
+        
+        # Load the summary into the cache first so the lock below is never held across a SQLite read
+        self.get_session_summary(user_id, session_id)
+        # Serialized so two concurrent turns of a session can't drop each other's summary line
+        with self.summary_update_lock:
+            lines, turn_count = self.get_session_summary(user_id, session_id)
+            line = self.summarize_turn(user_message, assistant_response)
+            summary = (lines + [line])[-self.summary_lines:], turn_count + 1
+            self._cache_summary((user_id, session_id), summary)
+            if self.write_behind:
+                with self.pending_cond:
+                    self.pending.append(row)
+                    self.pending_summaries[(user_id, session_id)] = summary
+                    # Only once the row is visible to _load_history, so a load that starts after this sees it
+                    self._cache_turn(row)
+                    if len(self.pending) >= self.flush_size:
+                        self.pending_cond.notify()
                 return
-                
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO conversation_history 
-                (user_id, session_id, user_message, assistant_response, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, session_id, user_message, assistant_response, datetime.utcnow()))
-            conn.commit()
-            cur.close()
-            conn.close()
+        
+        try:
+            self._write_rows([row], {(user_id, session_id): summary})
         except Exception as e:
             logger.error(f"Error storing conversation: {e}")
+            return
+        self._cache_turn(row)
+    
+    def _cache_turn(self, row):
+        # Invalidates any load already in flight, which may have read storage before the row landed
+        if self.session_cache:
+            self.session_cache.append((row[0], row[1]), (row[2], row[3]))
     
     def get_conversation_history(self, user_id: str, session_id: str, limit: int = 5):
+        if not self.session_cache:
+            return self._load_history(user_id, session_id, limit)
+        
+        key = (user_id, session_id)
+        turns = self.session_cache.get(key, limit)
+        if turns is not None:
+            return turns
+        token = self.session_cache.begin_load(key)
+        turns = self._load_history(user_id, session_id, max(limit, self.session_cache.max_turns))
+        self.session_cache.finish_load(key, token, turns)
+        return turns[:limit]
+    
+    def get_session_summary(self, user_id: str, session_id: str):
+        """Return (summary lines oldest first, number of turns summarized so far)"""
+        key = (user_id, session_id)
+        with self.summary_lock:
+            summary = self.summaries.get(key)
+            if summary is not None:
+                self.summaries.move_to_end(key)
+                return list(summary[0]), summary[1]
+        with self.pending_cond:
+            summary = self.pending_summaries.get(key)
+        if summary is None:
+            try:
+                with self.pool.connection() as conn:
+                    row = conn.execute(SELECT_SUMMARY_SQL, key).fetchone()
+            except Exception as e:
+                logger.error(f"Error getting conversation summary: {e}")
+                return [], 0
+            summary = (row["summary"].split("\n") if row and row["summary"] else [], row["turn_count"] if row else 0)
+        with self.summary_lock:
+            # A store that raced with the read has the newer summary, so keep it
+            summary = self.summaries.setdefault(key, summary)
+            self._evict_summaries()
+        return list(summary[0]), summary[1]
+    
+    @staticmethod
+    def summarize_turn(user_message: str, assistant_response: str, max_chars: int = 160) -> str:
+        """One extractive summary line: the question and the first sentence of the answer"""
+        def clip(text, limit):
+            text = " ".join(re.sub(r'[*#`]+', '', text).split())
+            return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+        
+        answer = TextToSpeechService.SENTENCE_BOUNDARY.split((assistant_response or "").strip(), maxsplit=1)[0]
+        return f"- User: {clip(user_message or '', max_chars // 2)} | Assistant: {clip(answer, max_chars)}"
+    
+    def _cache_summary(self, key, summary):
+        with self.summary_lock:
+            self.summaries[key] = summary
+            self.summaries.move_to_end(key)
+            self._evict_summaries()
+    
+    def _evict_summaries(self):
+        # Caller holds self.summary_lock
+        while len(self.summaries) > self.max_cached_summaries:
+            self.summaries.popitem(last=False)
+    
+    def _load_history(self, user_id: str, session_id: str, limit: int):
+        # Snapshot the buffer before reading SQLite: a flush in between shows up
+        # in both, and duplicates are dropped by timestamp below
+        with self.pending_cond:
+            buffered = [
+                (row[2], row[3], row[4]) for row in self.pending
+                if row[0] == user_id and row[1] == session_id
+            ]
         try:
-            conn = get_db_connection()
-            if conn is None:
-                logger.warning("No database connection. Returning empty history.")
-                return []
-                
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT user_message, assistant_response 
-                FROM conversation_history 
-                WHERE user_id = ? AND session_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            """, (user_id, session_id, limit))
-            results = cur.fetchall()
-            cur.close()
-            conn.close()
-            return results
+            with self.pool.connection() as conn:
+                stored = [tuple(row) for row in conn.execute(SELECT_HISTORY_SQL, (user_id, session_id, limit)).fetchall()]
         except Exception as e:
             logger.error(f"Error getting conversation history: {e}")
+            stored = []
+        
+        if buffered:
+            stored_timestamps = {row[2] for row in stored}
+            stored += [row for row in buffered if row[2] not in stored_timestamps]
+            stored.sort(key=lambda row: row[2], reverse=True)
+        return [(user_message, assistant_response) for user_message, assistant_response, _ in stored[:limit]]
+    
+    def flush(self):
+        """Write every buffered turn in one transaction"""
+        with self.flush_lock:
+            with self.pending_cond:
+                batch = list(self.pending)
+                summaries = dict(self.pending_summaries)
+            if not batch and not summaries:
+                return
+            try:
+                self._write_rows(batch, summaries)
+            except Exception as e:
+                # Rows stay buffered (and visible to reads) and are retried on the next flush
+                self.flush_failures += 1
+                self.consecutive_failures += 1
+                logger.error(f"Error flushing {len(batch)} conversation turns: {e}")
+                self._drop_excess()
+                return
+            self.consecutive_failures = 0
+            with self.pending_cond:
+                # Only the flusher removes rows and new rows are appended, so the batch is still the prefix
+                del self.pending[:len(batch)]
+                for key, summary in summaries.items():
+                    # A newer summary stored during the write is left for the next flush
+                    if self.pending_summaries.get(key) is summary:
+                        del self.pending_summaries[key]
+            self.flushed_rows += len(batch)
+            self.flush_batches += 1
+    
+    def _drop_excess(self):
+        # Caller holds self.flush_lock, so trimming the front can't race with a flush
+        with self.pending_cond:
+            excess = len(self.pending) - self.max_pending
+            if excess <= 0:
+                return
+            del self.pending[:excess]
+            self.dropped_rows += excess
+        logger.warning(f"Conversation buffer over {self.max_pending} turns, dropped the oldest {excess}")
+    
+    def close(self):
+        """Stop the flusher and write out anything still buffered"""
+        if self.flusher:
+            with self.pending_cond:
+                self.stopping = True
+                self.pending_cond.notify()
+            self.flusher.join(timeout=10)
+            self.flusher = None
+        self.flush()
+    
+    def stats(self) -> dict:
+        with self.pending_cond:
+            pending = len(self.pending)
+        return {
+            "write_behind": self.write_behind,
+            "pending": pending,
+            "flushed_rows": self.flushed_rows,
+            "flush_batches": self.flush_batches,
+            "flush_failures": self.flush_failures,
+            "dropped_rows": self.dropped_rows,
+            "session_cache": self.session_cache.stats() if self.session_cache else None
+        }
+    
+    def _write_rows(self, rows, summaries=None):
+        updated_at = datetime.utcnow().isoformat(" ")
+        with self.pool.connection() as conn:
+            with conn:
+                conn.executemany(INSERT_CONVERSATION_SQL, rows)
+                if summaries:
+                    conn.executemany(UPSERT_SUMMARY_SQL, [
+                        (user_id, session_id, "\n".join(lines), turn_count, updated_at)
+                        for (user_id, session_id), (lines, turn_count) in summaries.items()
+                    ])
+    
+    def _flush_loop(self):
+        while True:
+            with self.pending_cond:
+                if self.consecutive_failures:
+                    # Storage is failing: wait out the backoff, cut short only by shutdown
+                    delay = min(self.backoff_max, self.flush_interval * 2 ** min(self.consecutive_failures, 16)) * random.uniform(0.5, 1.0)
+                    self.pending_cond.wait_for(lambda: self.stopping, timeout=delay)
+                else:
+                    self.pending_cond.wait_for(
+                        lambda: self.stopping or len(self.pending) >= self.flush_size,
+                        timeout=self.flush_interval
+                    )
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                return
+
+SELECT_INVENTORY_SQL = "SELECT id, price, stock FROM products WHERE id IN ({placeholders})"
+
+SELECT_INVENTORY_VERSION_SQL = "SELECT COUNT(*), MAX(updated_at) FROM products"
+
+class ProductInventory:
+    """Live price and stock from the products table, the source of truth for both.
+    
+    Lookups are bulk, one IN query for all ids not already cached, and
+    results (including misses) are cached for ttl seconds, so an inventory
+    update shows up in answers within ttl. Products missing from the table
+    keep the values the catalog was ingested with.
+    """
+    
+    def __init__(self, pool: SQLiteConnectionPool, ttl: float = 5.0, max_entries: int = 100000):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # id -> (price, stock, expires at); price/stock None when not in the table
+        self.lock = threading.Lock()
+        self._version = None
+        self._version_expires = 0.0
+        self.hits = 0
+        self.misses = 0
+    
+    def lookup(self, product_ids) -> dict:
+        """id -> (price, stock) for the ids present in the products table"""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self.lock:
+            for product_id in dict.fromkeys(product_ids):
+                entry = self.entries.get(product_id)
+                if entry is not None and entry[2] > now:
+                    self.hits += 1
+                    if entry[0] is not None or entry[1] is not None:
+                        found[product_id] = entry[:2]
+                else:
+                    self.misses += 1
+                    missing.append(product_id)
+        if not missing:
+            return found
+        
+        try:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    SELECT_INVENTORY_SQL.format(placeholders=", ".join("?" * len(missing))), missing
+                ).fetchall()
+        except Exception as e:
+            logger.error(f"Error reading inventory: {e}")
+            return found
+        fetched = {row["id"]: (row["price"], row["stock"]) for row in rows}
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for product_id in missing:
+                price, stock = fetched.get(product_id, (None, None))
+                self.entries[product_id] = (price, stock, expires)
+                self.entries.move_to_end(product_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        found.update(fetched)
+        return found
+    
+    def apply(self, products):
+        """Copies of the products with live price and stock joined in"""
+        live = self.lookup([product['id'] for product in products if product.get('id')])
+        joined = []
+        for product in products:
+            price, stock = live.get(product.get('id'), (None, None))
+            if price is None and stock is None:
+                joined.append(product)
+                continue
+            product = dict(product)
+            if price is not None:
+                product['price'] = price
+            if stock is not None:
+                product['stock'] = stock
+            joined.append(product)
+        return joined
+    
+    def version(self) -> str:
+        """Changes whenever a price or stock level changes; re-read at most every ttl seconds"""
+        now = time.monotonic()
+        if self._version is None or now >= self._version_expires:
+            try:
+                with self.pool.connection() as conn:
+                    count, updated_at = conn.execute(SELECT_INVENTORY_VERSION_SQL).fetchone()
+                self._version = f"{count}:{updated_at or ''}"
+            except Exception as e:
+                logger.error(f"Error reading inventory version: {e}")
+                self._version = self._version or ""
+            self._version_expires = now + self.ttl
+        return self._version
+    
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class EmbeddingCache:
+    """LRU of normalized query text -> embedding vector"""
+    
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize(query: str) -> str:
+        # The MiniLM tokenizer lowercases anyway, so case and spacing variants share an embedding
+        return " ".join(query.lower().split())
+    
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+    
+    def put(self, key: str, embedding: np.ndarray):
+        with self.lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class MicroBatcher:
+    """Coalesces calls from concurrent threads into one batched call.
+    
+    submit() blocks its caller until a background thread has run
+    process_batch over a batch containing its item. A batch is everything
+    submitted within window seconds of its first item (at most max_batch
+    items), plus whatever queued up while the previous batch was running.
+    process_batch takes a list of items and returns their results in order.
+    """
+    
+    def __init__(self, process_batch, window: float = 0.002, max_batch: int = 32, name: str = "micro-batcher"):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self.worker.start()
+    
+    def submit(self, item):
+        future = Future()
+        self.requests.put((item, future))
+        return future.result()
+    
+    def close(self):
+        self.requests.put(None)
+        self.worker.join(timeout=5)
+    
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0
+        }
+    
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    # Past the window, still take whatever is already queued
+                    request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    # Finish this batch, then stop
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+
+class QueryConstraints:
+    """Price, age, category and stock constraints parsed from a user query.
+    
+    Prices only count when marked as money ("$100", "100 dollars") so "under
+    10" in "toys for kids under 10" isn't read as a budget. Categories are
+    restricted to those present in the catalog. Price and stock change after
+    ingest, so they are never pushed into the index or where filter; they
+    are checked with matches() once live values are joined in.
+    """
+    
+    KHMER_DIGITS = str.maketrans("០១២៣៤៥៦៧៨៩", "0123456789")
+    MONEY = r"(?:\$\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:\$|usd\b|dollars?\b|bucks\b|ដុល្លារ))"
+    PRICE_BETWEEN = re.compile(r"(?:between\s*|ចន្លោះ\s*)?" + MONEY + r"\s*(?:-|–|to|and|ដល់|និង)\s*" + MONEY)
+    PRICE_MAX = re.compile(r"(?:under|below|less than|cheaper than|at most|max(?:imum)?|up to|no more than|within|<=?|ក្រោម|តិចជាង|មិនលើស)\s*" + MONEY)
+    PRICE_MIN = re.compile(r"(?:over|above|more than|at least|min(?:imum)?|from|>=?|លើស|ច្រើនជាង)\s*" + MONEY)
+    AGE_RANGE = re.compile(r"(?:(?:ages?|aged|អាយុ)\s*(\d{1,2})\s*(?:-|–|to|ដល់)\s*(\d{1,2})|(\d{1,2})\s*(?:-|–|to)\s*(\d{1,2})\s*(?:years?|yrs?|yo|ឆ្នាំ))")
+    AGE = re.compile(r"(?:(\d{1,2})[\s-]*(?:years?|yrs?)[\s-]*olds?\b|(\d{1,2})\s*(?:yo|y/o)\b|(?:age|aged|អាយុ)\s*(\d{1,2})|(\d{1,2})\s*ឆ្នាំ)")
+    AGE_BELOW = re.compile(r"(?:under|below|younger than|ក្រោម)\s*$")
+    AGE_ABOVE = re.compile(r"(?:over|above|older than|លើស)\s*$")
+    IN_STOCK = re.compile(r"\b(?:in[\s-]stock|available)\b|មានស្តុក|មានលក់")
+    CATEGORY_KEYWORDS = [
+        (r"\bsciences?\b|វិទ្យាសាស្ត្រ", ["Science", "Physics", "Biology", "Astronomy", "Geology", "Meteorology", "Environmental Science"]),
+        (r"\bstem\b", ["STEM", "Science", "Engineering", "Technology", "Mathematics"]),
+        (r"\bmath(?:s|ematics)?\b|គណិតវិទ្យា", ["Mathematics"]),
+        (r"\barts?\b|\bpainting\b|\bdrawing\b|សិល្បៈ", ["Art"]),
+        (r"\bbooks?\b|\breading\b|សៀវភៅ", ["Books"]),
+        (r"\belectronics?\b|\bgadgets?\b|អេឡិចត្រូនិច", ["Electronics"]),
+        (r"\btech(?:nology)?\b|\bcoding\b|\bprogramming\b|បច្ចេកវិទ្យា", ["Technology", "Electronics"]),
+        (r"\bengineering\b", ["Engineering"]),
+        (r"\bearly learning\b|\bpreschool\b|\btoddlers?\b|\bkindergarten\b|មត្តេយ្យ", ["Early Learning"]),
+        (r"\bclassrooms?\b|\bteachers?\b|ថ្នាក់រៀន|គ្រូ", ["Classroom"])
+    ]
+    
+    def __init__(self, price_min: Optional[float] = None, price_max: Optional[float] = None, age=None,
+                 categories=(), in_stock: bool = False):
+        self.price_min = price_min
+        self.price_max = price_max
+        self.age = age  # (youngest, oldest) the products must suit, or None
+        self.categories = sorted(set(categories))
+        self.in_stock = in_stock
+    
+    @classmethod
+    def keyword_categories(cls) -> list:
+        """Every category name the keywords can map to, for when the catalog's own names aren't loaded"""
+        return sorted({name for _, names in cls.CATEGORY_KEYWORDS for name in names})
+    
+    @classmethod
+    def parse(cls, query: str, catalog_categories=()) -> "QueryConstraints":
+        text = (query or "").lower().translate(cls.KHMER_DIGITS)
+        price_min = price_max = None
+        match = cls.PRICE_BETWEEN.search(text)
+        if match:
+            low, high = sorted(float(value) for value in match.groups() if value is not None)
+            price_min, price_max = low, high
+        else:
+            match = cls.PRICE_MAX.search(text)
+            if match:
+                price_max = float(match.group(1) or match.group(2))
+            match = cls.PRICE_MIN.search(text)
+            if match:
+                price_min = float(match.group(1) or match.group(2))
+        
+        age = None
+        match = cls.AGE_RANGE.search(text)
+        if match:
+            low, high = sorted(int(value) for value in match.groups() if value is not None)
+            age = (low, high)
+        else:
+            match = cls.AGE.search(text)
+            if match:
+                years = int(next(value for value in match.groups() if value is not None))
+                before = text[:match.start()]
+                if cls.AGE_BELOW.search(before):
+                    age = (0, years)
+                elif cls.AGE_ABOVE.search(before):
+                    age = (years, MAX_AGE)
+                else:
+                    age = (years, years)
+        
+        known = {category.lower(): category for category in catalog_categories}
+        categories = set()
+        for pattern, names in cls.CATEGORY_KEYWORDS:
+            if re.search(pattern, text):
+                categories.update(known[name.lower()] for name in names if name.lower() in known)
+        
+        return cls(price_min, price_max, age, categories, bool(cls.IN_STOCK.search(text)))
+    
+    def __bool__(self) -> bool:
+        return self.price_min is not None or self.price_max is not None or self.age is not None or bool(self.categories) or self.in_stock
+    
+    def key(self) -> str:
+        """Stable text form, used to keep cached replies for differently constrained queries apart"""
+        parts = []
+        if self.price_min is not None:
+            parts.append(f"price>={self.price_min:g}")
+        if self.price_max is not None:
+            parts.append(f"price<={self.price_max:g}")
+        if self.age is not None:
+            parts.append(f"age={self.age[0]}-{self.age[1]}")
+        if self.categories:
+            parts.append("category=" + ",".join(self.categories))
+        if self.in_stock:
+            parts.append("in_stock")
+        return ";".join(parts)
+    
+    @property
+    def inventory_bound(self) -> bool:
+        """True when the query constrains price or stock, which only live inventory can answer"""
+        return self.price_min is not None or self.price_max is not None or self.in_stock
+    
+    def where(self, age_indexed: bool = True) -> Optional[dict]:
+        """Chroma where filter on category and age; age is left out when the collection has no age_min/age_max metadata"""
+        conditions = []
+        if self.categories:
+            conditions.append({"category": {"$in": self.categories}})
+        if self.age is not None and age_indexed:
+            conditions.append({"age_min": {"$lte": self.age[1]}})
+            conditions.append({"age_max": {"$gte": self.age[0]}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    
+    def matches(self, product: dict, inventory: bool = True) -> bool:
+        """Check a product in Python; products missing a field aren't excluded on it.
+        
+        With inventory=False price and stock are skipped, for products still
+        carrying the values they were ingested with.
+        """
+        price = product.get('price') if inventory else None
+        if isinstance(price, (int, float)):
+            if self.price_min is not None and price < self.price_min:
+                return False
+            if self.price_max is not None and price > self.price_max:
+                return False
+        if inventory and self.in_stock and isinstance(product.get('stock'), (int, float)) and product['stock'] <= 0:
+            return False
+        if self.categories and product.get('category') and product['category'] not in self.categories:
+            return False
+        if self.age is not None:
+            if 'age_min' in product and 'age_max' in product:
+                bounds = (product['age_min'], product['age_max'])
+            else:
+                bounds = parse_age_range(product.get('age_range', ''))
+            if bounds and (bounds[0] > self.age[1] or bounds[1] < self.age[0]):
+                return False
+        return True
+
+class ProductLexicalIndex:
+    """In-process BM25 index over the catalog documents.
+    
+    Product name and brand are indexed again on top of the document text so
+    exact mentions of them outrank passing matches in descriptions. A search
+    is decisive when the best hit's full name or brand appears in the query,
+    in which case the lexical ranking alone is trusted.
+    """
+    
+    TOKEN_PATTERN = re.compile(r"\w+")
+    
+    def __init__(self, products, documents, k1: float = 1.5, b: float = 0.75):
+        self.products = products
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> [(product index, term frequency)]
+        self.doc_lengths = []
+        self.phrases = []  # per product: token tuples of its name and brand
+        self.names = []  # per product: token tuple of its name
+        for index, (product, document) in enumerate(zip(products, documents)):
+            name = tuple(self.tokenize(product['name']))
+            brand = tuple(self.tokenize(product['brand']))
+            tokens = self.tokenize(document or "") + 2 * (list(name) + list(brand))
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((index, frequency))
+            self.doc_lengths.append(len(tokens))
+            self.phrases.append([phrase for phrase in (name, brand) if phrase])
+            self.names.append(name)
+        self.categories = sorted({product['category'] for product in products if product['category']})
+        # Collections ingested before age bounds were added can't take an age where filter
+        self.age_indexed = bool(products) and all('age_min' in product for product in products)
+        self.avg_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        count = len(products)
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+    
+    @classmethod
+    def tokenize(cls, text: str):
+        # Fold simple plurals so "kits" finds "kit"
+        return [
+            token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+            for token in cls.TOKEN_PATTERN.findall(text.lower())
+        ]
+    
+    def search(self, query: str, limit: int, accept=None):
+        """Return ([(product index, score)] best first, decisive), keeping only products accept() allows"""
+        query_tokens = self.tokenize(query)
+        scores = {}
+        for term in set(query_tokens):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[index] / self.avg_length
+                scores[index] = scores.get(index, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        if accept is not None:
+            scores = {index: score for index, score in scores.items() if accept(self.products[index])}
+        hits = sorted(scores.items(), key=lambda hit: hit[1], reverse=True)[:limit]
+        return hits, bool(hits) and self._mentions(query_tokens, hits[0][0])
+    
+    def named_products(self, query: str):
+        """Indexes of products whose full name appears in the query, leaving out names inside a longer matched name"""
+        query_tokens = self.tokenize(query)
+        matched = [index for index, name in enumerate(self.names) if name and self._contains(query_tokens, name)]
+        return [
+            index for index in matched
+            if not any(len(self.names[other]) > len(self.names[index]) and self._contains(self.names[other], self.names[index]) for other in matched)
+        ]
+    
+    def _mentions(self, query_tokens, index: int) -> bool:
+        return any(self._contains(query_tokens, phrase) for phrase in self.phrases[index])
+    
+    @staticmethod
+    def _contains(tokens, phrase) -> bool:
+        return any(tuple(tokens[start:start + len(phrase)]) == phrase for start in range(len(tokens) - len(phrase) + 1))
+
+class NumpyProductIndex:
+    """Every product embedding held in RAM as one normalized float32 matrix.
+    
+    Top-k is a single matrix-vector product plus argpartition, and category
+    and age constraints become boolean masks over arrays precomputed at
+    load (price and stock are filtered on live values afterwards). Meant for catalogs of up to a few thousand
+    products; larger ones stay on Chroma's HNSW index.
+    """
+    
+    def __init__(self, products, embeddings):
+        self.products = products
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+        self.category = np.array([product.get('category', '') for product in products], dtype=object)
+        # Age bounds from metadata, or parsed from the label for collections ingested without them
+        bounds = [
+            (product['age_min'], product['age_max']) if 'age_min' in product else parse_age_range(product.get('age_range', ''))
+            for product in products
+        ]
+        self.age_min = np.array([bound[0] if bound else np.nan for bound in bounds], dtype=np.float64)
+        self.age_max = np.array([bound[1] if bound else np.nan for bound in bounds], dtype=np.float64)
+    
+    def mask(self, constraints: QueryConstraints) -> Optional[np.ndarray]:
+        """Products satisfying the category and age constraints; like QueryConstraints.matches, missing values pass"""
+        if not constraints.categories and constraints.age is None:
+            return None
+        mask = np.ones(len(self.products), dtype=bool)
+        if constraints.categories:
+            mask &= np.isin(self.category, constraints.categories) | (self.category == '')
+        if constraints.age is not None:
+            mask &= ~(self.age_min > constraints.age[1]) & ~(self.age_max < constraints.age[0])
+        return mask
+    
+    def search(self, query_embedding: np.ndarray, n_results: int, constraints: Optional[QueryConstraints] = None):
+        """Most similar products first (cosine similarity)"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = self.matrix @ (query / (np.linalg.norm(query) or 1.0))
+        mask = self.mask(constraints) if constraints is not None else None
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(n_results, int(mask.sum()) if mask is not None else len(scores))
+        if k <= 0:
             return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.products[index] for index in top]
+
+class ChromaStore:
+    """Shared handle on the ChromaDB product collection.
+    
+    The PersistentClient and collection are opened on first use and then
+    reused by product search and the health endpoints; a failed open is
+    retried at most every retry_interval seconds. The path defaults to
+    CHROMA_DB_PATH, or chroma_db next to this file, so it doesn't depend on
+    the working directory. count() is cached for count_ttl seconds.
+    """
+    
+    def __init__(self, path: Optional[str] = None, collection_name: str = "education_products",
+                 count_ttl: float = 5.0, retry_interval: float = 30.0):
+        self.path = os.path.abspath(path or os.getenv("CHROMA_DB_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "chroma_db"))
+        self.collection_name = collection_name
+        # Same default all-MiniLM-L6-v2 function the collection was built with
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        self.count_ttl = count_ttl
+        self.retry_interval = retry_interval
+        self.error = None
+        self.client_opens = 0
+        self._client = None
+        self._collection = None
+        self._failed_at = None
+        self._count = None
+        self._counted_at = 0.0
+        self._lock = threading.Lock()
+    
+    def collection(self):
+        """The product collection, or None if ChromaDB can't be opened"""
+        if self._collection is not None:
+            return self._collection
+        with self._lock:
+            if self._collection is None and (self._failed_at is None or time.monotonic() - self._failed_at >= self.retry_interval):
+                try:
+                    if self._client is None:
+                        self._client = chromadb.PersistentClient(path=self.path)
+                        self.client_opens += 1
+                    self._collection = self._client.get_collection(self.collection_name, embedding_function=self.embedding_function)
+                    self.error = None
+                    logger.info(f"✅ ChromaDB connected successfully ({self.path})")
+                except Exception as e:
+                    self._failed_at = time.monotonic()
+                    self.error = str(e)
+                    logger.error(f"❌ ChromaDB connection failed: {e}")
+        return self._collection
+    
+    def refresh(self):
+        """(count, collection metadata) read fresh, so changes made by other processes show up"""
+        if self.collection() is None:
+            return None, None
+        collection = self._client.get_collection(self.collection_name, embedding_function=self.embedding_function)
+        count = collection.count()
+        self._count = count
+        self._counted_at = time.monotonic()
+        return count, collection.metadata
+    
+    def count(self) -> Optional[int]:
+        """Number of products, cached for count_ttl seconds; None if ChromaDB is unavailable"""
+        if self.collection() is None:
+            return None
+        if self._count is None or time.monotonic() - self._counted_at >= self.count_ttl:
+            self._count = self._collection.count()
+            self._counted_at = time.monotonic()
+        return self._count
+    
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "connected": self._collection is not None,
+            "client_opens": self.client_opens,
+            "count": self._count,
+            "error": self.error
+        }
 
 class ChromaProductSearch:
-    def __init__(self):
+    def __init__(self, store: Optional[ChromaStore] = None, inventory: Optional[ProductInventory] = None):
+        self.store = store or ChromaStore()
+        # Live price/stock joined into results; price and stock constraints are checked against it
+        self.inventory = inventory
+        # Candidates fetched per result for price/stock queries, as those are filtered after retrieval
+        self.inventory_overfetch = 4
+        # Shared with the response cache
+        self.embedding_function = self.store.embedding_function
+        self.catalog_version_ttl = float(os.getenv("CATALOG_VERSION_TTL", "30"))
+        self._catalog_version = None
+        self._catalog_version_checked = 0.0
+        # "hybrid" fuses BM25 with vector search, "vector" and "lexical" use one of them alone
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid")
+        self.rrf_k = 60
+        # "auto" answers vector search from NumpyProductIndex while the catalog has at most
+        # NUMPY_INDEX_MAX_PRODUCTS products, "numpy" always does, "chroma" never does
+        self.search_backend = os.getenv("PRODUCT_SEARCH_BACKEND", "auto")
+        self.numpy_index_max_products = int(os.getenv("NUMPY_INDEX_MAX_PRODUCTS", "20000"))
+        # Above LEXICAL_INDEX_MAX_PRODUCTS the catalog isn't loaded into BM25; search is vector plus where filters
+        self.lexical_index_max_products = int(os.getenv("LEXICAL_INDEX_MAX_PRODUCTS", "20000"))
+        self._lexical_index = None
+        self._numpy_index = None
+        self._categories = QueryConstraints.keyword_categories()
+        self._loaded_version = None
+        self._catalog_lock = threading.Lock()
+        self.queries = 0
+        self.lexical_short_circuits = 0
+        self.filtered_queries = 0
+        self.constraint_misses = 0
+        self.embedding_cache = EmbeddingCache(int(os.getenv("EMBEDDING_CACHE_SIZE", "4096")))
+        # Concurrent searches share one embedding call and one collection.query per batch
+        self.embedding_batcher = None
+        self.query_batcher = None
+        if os.getenv("SEARCH_BATCHING", "1") == "1":
+            window = float(os.getenv("SEARCH_BATCH_WINDOW_MS", "2")) / 1000
+            max_batch = int(os.getenv("SEARCH_BATCH_MAX", "32"))
+            self.embedding_batcher = MicroBatcher(self._embed_batch, window, max_batch, name="embedding-batcher")
+            self.query_batcher = MicroBatcher(self._query_batch, window, max_batch, name="query-batcher")
+        if self.collection:
+            self._load_catalog()
+    
+    @property
+    def collection(self):
+        return self.store.collection()
+    
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query with the collection's embedding function, or None if unavailable"""
+        if not self.collection:
+            return None
+        key = EmbeddingCache.normalize(query)
+        embedding = self.embedding_cache.get(key)
+        if embedding is not None:
+            return embedding
         try:
-            self.client = chromadb.PersistentClient(path="./chroma_db")
-            self.collection = self.client.get_collection("education_products")
-            logger.info("✅ ChromaDB connected successfully")
+            if self.embedding_batcher:
+                embedding = self.embedding_batcher.submit(key)
+            else:
+                embedding = self._embed_batch([key])[0]
         except Exception as e:
-            logger.error(f"❌ ChromaDB connection failed: {e}")
-            self.collection = None
+            logger.error(f"Error embedding query: {e}")
+            return None
+        self.embedding_cache.put(key, embedding)
+        return embedding
+    
+    def close(self):
+        """Stop the batching threads"""
+        for batcher in (self.embedding_batcher, self.query_batcher):
+            if batcher:
+                batcher.close()
+    
+    def catalog_version(self) -> Optional[str]:
+        """Stamp that changes whenever the product collection changes.
+        
+        Combines the product count with the collection's catalog_version
+        metadata (if the ingestion tooling sets one); re-read at most every
+        CATALOG_VERSION_TTL seconds.
+        """
+        if not self.collection:
+            return None
+        now = time.monotonic()
+        if self._catalog_version is None or now - self._catalog_version_checked >= self.catalog_version_ttl:
+            try:
+                count, metadata = self.store.refresh()
+                stamp = (metadata or {}).get("catalog_version", "")
+                self._catalog_version = f"{count}:{stamp}"
+            except Exception as e:
+                logger.error(f"Error reading catalog version: {e}")
+            self._catalog_version_checked = now
+        return self._catalog_version
+    
+    def lexical_index(self) -> Optional[ProductLexicalIndex]:
+        """BM25 index over the catalog, rebuilt when the catalog version changes; None above LEXICAL_INDEX_MAX_PRODUCTS"""
+        self._load_catalog()
+        return self._lexical_index
+    
+    def numpy_index(self) -> Optional[NumpyProductIndex]:
+        """In-memory vector index, or None when vector search goes to Chroma"""
+        self._load_catalog()
+        return self._numpy_index
     
-    def search_products(self, query: str, n_results: int = 5):
+    def catalog_categories(self) -> list:
+        """Category names query constraints resolve to: the catalog's own when it is loaded in memory, else the keyword names"""
+        self._load_catalog()
+        return self._categories
+    
+    def _load_catalog(self):
+        """Load the catalog once per catalog version and rebuild the in-memory indexes from it"""
+        version = self.catalog_version()
+        if version is None or version == self._loaded_version:
+            return
+        with self._catalog_lock:
+            if version == self._loaded_version:
+                return
+            try:
+                count = self.collection.count()
+                use_numpy = self.search_backend == "numpy" or (self.search_backend == "auto" and count <= self.numpy_index_max_products)
+                use_lexical = count <= self.lexical_index_max_products
+                products = []
+                if use_numpy or use_lexical:
+                    include = ["metadatas"] + (["documents"] if use_lexical else []) + (["embeddings"] if use_numpy else [])
+                    results = self.collection.get(include=include)
+                    products = [self._product(product_id, metadata) for product_id, metadata in zip(results['ids'], results['metadatas'])]
+                self._lexical_index = ProductLexicalIndex(products, results['documents']) if use_lexical else None
+                self._numpy_index = NumpyProductIndex(products, results['embeddings']) if use_numpy and products else None
+                self._categories = sorted({product['category'] for product in products if product['category']}) if products \
+                    else QueryConstraints.keyword_categories()
+                self._loaded_version = version
+                if not use_lexical:
+                    logger.warning(f"{count} products is over LEXICAL_INDEX_MAX_PRODUCTS={self.lexical_index_max_products}, "
+                                   f"BM25 is off and search is vector-only with where filters")
+                backend = "numpy" if self._numpy_index else "chroma"
+                lexical = "BM25 + " if self._lexical_index else ""
+                logger.info(f"Loaded {len(products)} of {count} products (catalog {version}), search on {lexical}{backend}")
+            except Exception as e:
+                logger.error(f"Error loading product catalog: {e}")
+    
+    def parse_constraints(self, query: str) -> QueryConstraints:
+        return QueryConstraints.parse(query, self.catalog_categories() if self.collection else ())
+    
+    def lexical_decisive(self, query: str) -> bool:
+        """True when search_products will answer from the BM25 index alone, without a query embedding"""
+        if not self.collection or self.retrieval_mode == "vector":
+            return False
+        index = self.lexical_index()
+        if index is None:
+            return False
+        constraints = QueryConstraints.parse(query, index.categories)
+        accept = functools.partial(constraints.matches, inventory=False) if constraints else None
+        return self.retrieval_mode == "lexical" or index.search(query, 1, accept)[1]
+    
+    def search_products(self, query: str, n_results: int = 5, query_embedding: Optional[np.ndarray] = None):
         if not self.collection:
             logger.warning("ChromaDB not available, returning demo products")
             return self.get_demo_products()
         
         try:
-            # Search in ChromaDB
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
+            self.queries += 1
+            index = self.lexical_index()
+            constraints = QueryConstraints.parse(query, self.catalog_categories())
+            if constraints:
+                self.filtered_queries += 1
+            # Fusion draws on a wider candidate pool than is returned, wider still when live price/stock will filter it
+            pool = max(n_results * 4, 20) * (self.inventory_overfetch if constraints.inventory_bound else 1)
             
-            products = []
-            if results['metadatas']:
-                for metadata in results['metadatas'][0]:
-                    products.append({
-                        'name': metadata.get('product_name', ''),
-                        'description': metadata.get('description', ''),
-                        'price': metadata.get('price', 0),
-                        'category': metadata.get('category', ''),
-                        'stock': metadata.get('stock', 0),
-                        'age_range': metadata.get('age_range', ''),
-                        'brand': metadata.get('brand', ''),
-                        'features': metadata.get('features', '')
-                    })
+            lexical, decisive = [], False
+            if index and self.retrieval_mode != "vector":
+                hits, decisive = index.search(query, pool, functools.partial(constraints.matches, inventory=False) if constraints else None)
+                lexical = self._live([index.products[product_index] for product_index, _ in hits], constraints)
+                if decisive or (self.retrieval_mode == "lexical" and lexical):
+                    # An exact name or brand mention settles it, so skip embedding the query
+                    self.lexical_short_circuits += 1
+                    return self._matched(lexical[:n_results], constraints)
             
-            return products if products else self.get_demo_products()
+            candidates = min(pool, len(index.products)) if index else pool
+            products = self._vector_search(query, candidates, query_embedding, constraints, index.age_indexed if index else False)
+            # Also covers constraints the where filter couldn't express (age on an older collection)
+            products = self._live(products, constraints)
+            if lexical:
+                products = self._fuse(products, lexical)
+            return self._matched(products[:n_results], constraints)
             
         except Exception as e:
             logger.error(f"Error searching ChromaDB: {e}")
             return self.get_demo_products()
     
+    def _live(self, products, constraints: QueryConstraints):
+        """Products with live price and stock joined in, keeping those that satisfy the constraints"""
+        if self.inventory:
+            products = self.inventory.apply(products)
+        return [product for product in products if constraints.matches(product)] if constraints else products
+    
+    def _matched(self, products, constraints: QueryConstraints):
+        """Search results; with explicit constraints and nothing meeting them, none, so the reply says nothing matches"""
+        if products:
+            return products
+        if constraints:
+            self.constraint_misses += 1
+            logger.info(f"No products match {constraints.key()}")
+            return []
+        return self.get_demo_products()
+    
+    def stats(self) -> dict:
+        return {
+            "mode": self.retrieval_mode,
+            "queries": self.queries,
+            "lexical_short_circuits": self.lexical_short_circuits,
+            "filtered_queries": self.filtered_queries,
+            "constraint_misses": self.constraint_misses,
+            "embedding_cache": self.embedding_cache.stats(),
+            "embedding_batches": self.embedding_batcher.stats() if self.embedding_batcher else None,
+            "query_batches": self.query_batcher.stats() if self.query_batcher else None,
+            "indexed_products": len(self._lexical_index.products) if self._lexical_index else 0,
+            "lexical_index": self._lexical_index is not None,
+            "vector_backend": "numpy" if self._numpy_index else "chroma"
+        }
+    
+    def _vector_search(self, query: str, n_results: int, query_embedding: Optional[np.ndarray],
+                       constraints: QueryConstraints, age_indexed: bool = False):
+        """Nearest products satisfying the constraints, reusing the query embedding when the caller already has one"""
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        numpy_index = self.numpy_index()
+        if numpy_index is not None and query_embedding is not None:
+            try:
+                return numpy_index.search(query_embedding, n_results, constraints)
+            except Exception as e:
+                logger.error(f"Error searching the in-memory index, using ChromaDB: {e}")
+        
+        where = constraints.where(age_indexed)
+        if query_embedding is None:
+            results = self.collection.query(
+                query_texts=[query],
+                n_results=n_results,
+                where=where
+            )
+            ids, metadatas = results['ids'][0], results['metadatas'][0] if results['metadatas'] else []
+        elif self.query_batcher:
+            ids, metadatas = self.query_batcher.submit((query_embedding, n_results, where))
+        else:
+            ids, metadatas = self._query_batch([(query_embedding, n_results, where)])[0]
+        return [self._product(product_id, metadata) for product_id, metadata in zip(ids, metadatas)]
+    
+    def _embed_batch(self, texts):
+        # Identical texts in a batch are embedded once
+        unique = list(dict.fromkeys(texts))
+        vectors = dict(zip(unique, self.embedding_function(unique)))
+        return [np.asarray(vectors[text], dtype=np.float32) for text in texts]
+    
+    def _query_batch(self, requests):
+        """One collection.query per distinct (n_results, where) among (embedding, n_results, where) requests"""
+        groups = {}
+        for position, (embedding, n_results, where) in enumerate(requests):
+            key = (n_results, json.dumps(where, sort_keys=True))
+            groups.setdefault(key, []).append((position, embedding))
+        answers = [None] * len(requests)
+        for (n_results, where), members in groups.items():
+            results = self.collection.query(
+                query_embeddings=[embedding.tolist() for _, embedding in members],
+                n_results=n_results,
+                where=json.loads(where)
+            )
+            for row, (position, _) in enumerate(members):
+                answers[position] = (results['ids'][row], results['metadatas'][row] if results['metadatas'] else [])
+        return answers
+    
+    def _fuse(self, *rankings):
+        """Reciprocal rank fusion of product rankings, best first"""
+        scores = {}
+        products = {}
+        for ranking in rankings:
+            for rank, product in enumerate(ranking, 1):
+                scores[product['id']] = scores.get(product['id'], 0.0) + 1.0 / (self.rrf_k + rank)
+                products.setdefault(product['id'], product)
+        return [products[product_id] for product_id in sorted(scores, key=scores.get, reverse=True)]
+    
+    def _product(self, product_id: str, metadata: dict) -> dict:
+        return {
+            'id': product_id,
+            'name': metadata.get('product_name', ''),
+            'description': metadata.get('description', ''),
+            'price': metadata.get('price', 0),
+            'category': metadata.get('category', ''),
+            'stock': metadata.get('stock', 0),
+            'age_range': metadata.get('age_range', ''),
+            'brand': metadata.get('brand', ''),
+            'features': metadata.get('features', ''),
+            **({'age_min': metadata['age_min'], 'age_max': metadata['age_max']} if 'age_min' in metadata and 'age_max' in metadata else {})
+        }
+    
     def get_demo_products(self):
         """Return demo products when ChromaDB is not available"""
         return [
             {
+                'id': 'demo_1',
                 'name': 'STEM Robotics Kit Pro',
                 'description': 'Advanced robotics kit with coding capabilities for teens',
                 'price': 149.99,
@@ -207,6 +1973,7 @@ class ChromaProductSearch:
                 'features': 'AI programming, Multiple sensors, Machine learning'
             },
             {
+                'id': 'demo_2',
                 'name': 'Digital Microscope Pro',
                 'description': 'High-precision digital microscope with 2000x magnification',
                 'price': 129.99,
@@ -218,192 +1985,1176 @@ class ChromaProductSearch:
             }
         ]
 
-class EducationStoreRAG:
-    def __init__(self):
-        self.memory = ConversationMemory()
-        self.tts_service = TextToSpeechService()
-        self.product_search = ChromaProductSearch()
-        self.llm = llm
-        self.model = model if not LANGCHAIN_AVAILABLE else None
+class SemanticResponseCache:
+    """Caches first-turn replies keyed on the query embedding.
     
-    def get_context(self, query: str, language: str = "en"):
-        products = self.product_search.search_products(query)
-        
-        if not products:
-            if language == "km":
-                return "មិនមានផលិតផលជាក់លាក់ត្រូវនឹងសំណើររបស់អ្នកទេ។ ខ្ញុំអាចជួយឆ្លើយសំណួរទូទៅអំពីហាងផ្គត់ផ្គង់អប់រំបាន។"
-            else:
-                return "No specific products found matching your query. I can help with general education store questions."
-        
-        if language == "km":
-            context = "ផលិតផលអប់រំពាក់ព័ន្ធ៖\n"
-        else:
-            context = "Relevant Education Products:\n"
-            
-        for i, product in enumerate(products, 1):
-            name = product['name']
-            desc = product['description']
-            price = product['price']
-            category = product['category']
-            stock = product['stock']
-            age_range = product['age_range']
-            brand = product['brand']
-            features = product.get('features', '')
-            
-            if language == "km":
-                context += f"""{i}. {name} ({brand})
-   ការពិពណ៌នា៖ {desc}
-   លក្ខណៈពិសេស៖ {features}
-   ប្រភេទ៖ {category} | អាយុ៖ {age_range}
-   តម្លៃ៖ ${price} | ស្តុក៖ {stock} ឯកតា
-   
-"""
-            else:
-                context += f"""{i}. {name} ({brand})
-   Description: {desc}
+    A lookup hits when a cached query in the same language and catalog
+    version has cosine similarity >= threshold. Entries for older catalog
+    versions are dropped as soon as a new version is seen.
+    """
+    
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.catalog_version = None
+        self.buckets = {}  # language -> (vectors matrix, reply texts)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def lookup(self, embedding: np.ndarray, language: str, catalog_version: str) -> Optional[str]:
+        query = self._normalize(embedding)
+        with self.lock:
+            self._check_version(catalog_version)
+            vectors, texts = self.buckets.get(language, (None, []))
+            if texts:
+                scores = vectors @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return texts[best]
+            self.misses += 1
+            return None
+    
+    def store(self, embedding: np.ndarray, language: str, catalog_version: str, response_text: str):
+        query = self._normalize(embedding)
+        with self.lock:
+            self._check_version(catalog_version)
+            vectors, texts = self.buckets.get(language, (np.empty((0, query.shape[0]), dtype=np.float32), []))
+            vectors = np.vstack([vectors, query[None, :]])
+            texts = texts + [response_text]
+            if len(texts) > self.max_entries:
+                # Oldest entries go first
+                vectors, texts = vectors[-self.max_entries:], texts[-self.max_entries:]
+            self.buckets[language] = (vectors, texts)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(texts) for _, texts in self.buckets.values()),
+                "threshold": self.threshold,
+                "catalog_version": self.catalog_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_llm_calls": self.hits,
+                "invalidations": self.invalidations
+            }
+    
+    def _check_version(self, catalog_version: str):
+        # Caller holds self.lock
+        if catalog_version != self.catalog_version:
+            if self.buckets:
+                self.invalidations += 1
+            self.buckets = {}
+            self.catalog_version = catalog_version
+    
+    def _normalize(self, embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+PROMPT_TEMPLATES = {
+    "en": {
+        "header": """You are a friendly and knowledgeable assistant for "EduSmart Store", an education supplies retailer. 
+Help customers with product inquiries, recommendations, and educational advice.
+
+STORE INFORMATION:
+- We specialize in educational materials for all ages
+- Products include STEM kits, books, art supplies, classroom equipment
+- We offer products for teachers, parents, and students
+- Price range: $5 - $500""",
+        "footer": """Please respond in English and use the product information above to provide helpful responses.
+Maintain natural conversation flow and be positive about learning and education.""",
+        "products_heading": "Relevant Education Products:",
+        "no_products": "No specific products found matching your query. I can help with general education store questions.",
+        "product": """{name} ({brand})
+   Description: {description}
    Features: {features}
    Category: {category} | Age: {age_range}
-   Price: ${price} | Stock: {stock} units
+""",
+        # Rendered per request from live inventory, the rest of the product snippet is pre-rendered
+        "product_live": """   Price: ${price} | Stock: {stock} units
    
-"""
-        return context
-
-    def generate_response(self, user_message: str, user_id: str, session_id: str, response_type: str = "both", language: str = "en"):
-        try:
-            # If neither Gemini nor LangChain is configured, use a simple response
-            if not self.llm and not self.model:
-                if language == "km":
-                    simple_response = "ខ្ញុំនៅទីនេះដើម្បីជួយអ្នកជាមួយផលិតផលហាងអប់រំ! បច្ចុប្បន្នដំណើរការក្នុងរបៀបសាកល្បង។ សូមកំណត់ GEMINI_API_KEY សម្រាប់ការឆ្លើយតប AI។"
-                else:
-                    simple_response = "I'm here to help with education store products! Currently running in demo mode. Please configure GEMINI_API_KEY for AI responses."
-                
-                audio_data = self.tts_service.text_to_speech(simple_response, language) if response_type in ["voice", "both"] else None
-                return {
-                    "text": simple_response,
-                    "audio_data": audio_data,
-                    "response_type": response_type
-                }
-            
-            # Get conversation history
-            history = self.memory.get_conversation_history(user_id, session_id)
-            
-            # Get product context using ChromaDB
-            product_context = self.get_context(user_message, language)
-            
-            # Create conversation context
-            conversation_context = ""
-            for user_msg, assistant_resp in reversed(history):
-                conversation_context += f"User: {user_msg}\nAssistant: {assistant_resp}\n"
-            
-            # Create language-specific prompts
-            if language == "km":
-                system_prompt = """អ្នកគឺជាជំនួយការដែលមានចំណេះដឹង និងរួសរាយសម្រាប់ "ហាង EduSmart" ដែលជាហាងលក់ផលិតផលអប់រំ។ 
+""",
+        "summary_heading": "Earlier in this conversation (summary):"
+    },
+    "km": {
+        "header": """អ្នកគឺជាជំនួយការដែលមានចំណេះដឹង និងរួសរាយសម្រាប់ "ហាង EduSmart" ដែលជាហាងលក់ផលិតផលអប់រំ។ 
 ជួយអតិថិជនជាមួយនឹងការស្វែងរកផលិតផល ការណែនាំ និងដំបូន្មានអប់រំ។
 
 ព័ត៌មានហាង៖
 - យើងឯកទេសក្នុងការផ្គត់ផ្គង់សម្ភារៈអប់រំសម្រាប់អាយុគ្រប់ប្រភេទ
 - ផលិតផលរួមមានឧបករណ៍ STEM សៀវភៅ គ្រឿងសិល្បៈ ឧបករណ៍បន្ទប់រៀន
 - យើងផ្តល់ផលិតផលសម្រាប់គ្រូ ឪពុកម្តាយ និងសិស្ស
-- ជួរតម្លៃ៖ ៥$ - ៥០០$
-
-{product_context}
+- ជួរតម្លៃ៖ ៥$ - ៥០០$""",
+        "footer": """សូមឆ្លើយតបជាភាសាខ្មែរ និងប្រើប្រាស់ព័ត៌មានផលិតផលខាងលើដើម្បីផ្តល់ចម្លើយដែលមានប្រយោជន៍។
+រក្សាការសន្ទនាធម្មជាតិ និងលើកទឹកចិត្តអំពីការរៀនសូត្រ។""",
+        "products_heading": "ផលិតផលអប់រំពាក់ព័ន្ធ៖",
+        "no_products": "មិនមានផលិតផលជាក់លាក់ត្រូវនឹងសំណើររបស់អ្នកទេ។ ខ្ញុំអាចជួយឆ្លើយសំណួរទូទៅអំពីហាងផ្គត់ផ្គង់អប់រំបាន។",
+        "product": """{name} ({brand})
+   ការពិពណ៌នា៖ {description}
+   លក្ខណៈពិសេស៖ {features}
+   ប្រភេទ៖ {category} | អាយុ៖ {age_range}
+""",
+        "product_live": """   តម្លៃ៖ ${price} | ស្តុក៖ {stock} ឯកតា
+   
+""",
+        "summary_heading": "សេចក្តីសង្ខេបនៃការសន្ទនាមុន៖"
+    }
+}
 
-{conversation_context}
+# Replies for price/stock lookups answered without the LLM
+LOOKUP_TEMPLATES = {
+    "en": {
+        "price": "The {name} ({brand}) costs ${price:.2f}.",
+        "price_unknown": "I don't have a current price for the {name}.",
+        "in_stock": "The {name} is in stock, with {stock} units available.",
+        "low_stock": "The {name} is in stock, but only {stock} left.",
+        "out_of_stock": "Sorry, the {name} is currently out of stock.",
+        "stock_unknown": "I don't have current stock information for the {name}.",
+        "more": "Would you like to know more about it?"
+    },
+    "km": {
+        "price": "{name} ({brand}) មានតម្លៃ ${price:.2f}។",
+        "price_unknown": "ខ្ញុំមិនមានតម្លៃបច្ចុប្បន្នសម្រាប់ {name} ទេ។",
+        "in_stock": "{name} មានក្នុងស្តុក ចំនួន {stock} ឯកតា។",
+        "low_stock": "{name} មានក្នុងស្តុក ប៉ុន្តែនៅសល់តែ {stock} ប៉ុណ្ណោះ។",
+        "out_of_stock": "សូមអភ័យទោស {name} អស់ពីស្តុកហើយ។",
+        "stock_unknown": "ខ្ញុំមិនមានព័ត៌មានស្តុកបច្ចុប្បន្នសម្រាប់ {name} ទេ។",
+        "more": "តើអ្នកចង់ដឹងបន្ថែមអំពីផលិតផលនេះទេ?"
+    }
+}
 
-សូមឆ្លើយតបជាភាសាខ្មែរ និងប្រើប្រាស់ព័ត៌មានផលិតផលខាងលើដើម្បីផ្តល់ចម្លើយដែលមានប្រយោជន៍។
-រក្សាការសន្ទនាធម្មជាតិ និងលើកទឹកចិត្តអំពីការរៀនសូត្រ។"""
+class LookupRouter:
+    """Sends simple catalog lookups down a fast path that skips the LLM.
+    
+    A query is answered from product data when it asks for a price and/or
+    stock, names exactly one catalog product, has no open-ended cue
+    (comparisons, recommendations, suitability...) and nothing is left once
+    the product name, the price/stock cues and FILLER words are removed.
+    "How much does shipping cost for <product>?" keeps "shipping" and
+    escalates to the LLM, as does everything else. Replies are filled into
+    LOOKUP_TEMPLATES from the product's live price and stock.
+    """
+    
+    PRICE = re.compile(r"\b(?:prices?|priced|pricing|costs?|how much)\b|តម្លៃ|ថ្លៃ", re.IGNORECASE)
+    STOCK = re.compile(r"\b(?:in[\s-]stock|stock|available|availability|sold out|left|have any)\b|ស្តុក|ស្ដុក|នៅសល់|មានលក់", re.IGNORECASE)
+    OPEN_ENDED = re.compile(
+        r"\b(?:compare\w*|vs|versus|better|best|recommend\w*|suggest\w*|suitable|good for|difference|differ|which|why|should|"
+        r"worth|reviews?|explain|describe|features?|tell me about|alternatives?|similar|cheaper|discounts?|deals?)\b"
+        r"|ប្រៀបធៀប|ណែនាំ|ល្អជាង|ហេតុអ្វី|សមស្រប|មួយណា",
+        re.IGNORECASE
+    )
+    # Words that can surround a lookup without changing what it asks ("is the ... still in stock?")
+    FILLER = re.compile(
+        r"\b(?:the|a|an|is|are|was|it|its|this|that|of|for|what|s|whats|does|do|did|you|your|we|i|me|my|can|"
+        r"please|still|there|any|many|much|how|unit|units|currently|now|right|today|in|at|on|one|hi|hello|thanks?)\b"
+        r"|តើ|ប៉ុន្មាន|មាន|ទេ|នៅ|របស់|សម្រាប់|ក្នុង|ឯកតា|បាទ|ចាស|ដែរ|ហើយ|នេះ|សូម",
+        re.IGNORECASE
+    )
+    LOW_STOCK = 5
+    
+    def __init__(self):
+        self.routes = Counter()
+    
+    def classify(self, query: str, index: Optional[ProductLexicalIndex]):
+        """(intents, product) for a lookup the router can answer, or None to use the LLM"""
+        intents = tuple(intent for intent, pattern in (("price", self.PRICE), ("stock", self.STOCK)) if pattern.search(query))
+        route = None
+        if intents and index is not None and not self.OPEN_ENDED.search(query):
+            named = index.named_products(query)
+            if len(named) == 1 and not self._leftover(query, index.names[named[0]]):
+                route = intents, index.products[named[0]]
+        self.routes["lookup" if route else "llm"] += 1
+        return route
+    
+    def _leftover(self, query: str, name_tokens) -> str:
+        """What the query says besides the product name, lookup cues and filler"""
+        # Token by token as in ProductLexicalIndex.tokenize, which folded plurals ("kits") into the name
+        name = re.compile(r"\W+".join(re.escape(token) + "s?" for token in name_tokens), re.IGNORECASE)
+        rest = name.sub(" ", query, count=1)
+        for pattern in (self.PRICE, self.STOCK, self.FILLER):
+            rest = pattern.sub(" ", rest)
+        return " ".join(re.findall(r"\w+", rest))
+    
+    def answer(self, product: dict, intents, language: str = "en") -> str:
+        templates = LOOKUP_TEMPLATES["km" if language == "km" else "en"]
+        price = product.get('price')
+        stock = product.get('stock')
+        values = {"name": product['name'], "brand": product.get('brand') or "EduSmart", "price": price, "stock": stock}
+        # Products without a price in metadata come through as 0
+        known_price = isinstance(price, (int, float)) and price > 0
+        known_stock = isinstance(stock, (int, float))
+        parts = []
+        if "price" in intents:
+            parts.append(templates["price" if known_price else "price_unknown"])
+        if "stock" in intents or (known_stock and stock <= 0):
+            if not known_stock:
+                parts.append(templates["stock_unknown"])
+            elif stock <= 0:
+                parts.append(templates["out_of_stock"])
+            elif stock <= self.LOW_STOCK:
+                parts.append(templates["low_stock"])
             else:
-                system_prompt = """You are a friendly and knowledgeable assistant for "EduSmart Store", an education supplies retailer. 
-Help customers with product inquiries, recommendations, and educational advice.
+                parts.append(templates["in_stock"])
+        parts.append(templates["more"])
+        return " ".join(part.format(**values) for part in parts)
+    
+    def stats(self) -> dict:
+        total = sum(self.routes.values())
+        return {
+            "lookup": self.routes["lookup"],
+            "llm": self.routes["llm"],
+            "lookup_share": round(self.routes["lookup"] / total, 4) if total else 0.0
+        }
 
-STORE INFORMATION:
-- We specialize in educational materials for all ages
-- Products include STEM kits, books, art supplies, classroom equipment
-- We offer products for teachers, parents, and students
-- Price range: $5 - $500
+class LatencyRecorder:
+    """Per-stage latency over the last `window` samples of each stage, reported by /metrics"""
+    
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.samples = {}  # stage -> deque of seconds
+        self.counts = {}
+        self.lock = threading.Lock()
+    
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+    
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            snapshot = {stage: (self.counts[stage], sorted(samples)) for stage, samples in self.samples.items()}
+        stats = {}
+        for stage, (count, samples) in snapshot.items():
+            stats[stage] = {
+                "count": count,
+                "avg_ms": round(1000 * sum(samples) / len(samples), 3),
+                "p50_ms": round(1000 * samples[len(samples) // 2], 3),
+                "p95_ms": round(1000 * samples[min(int(len(samples) * 0.95), len(samples) - 1)], 3),
+                "max_ms": round(1000 * samples[-1], 3)
+            }
+        return stats
+
+class PromptBuilder:
+    """Assembles the system prompt within an estimated token budget.
+    
+    The store instructions always go in. Products are added in relevance
+    order up to product_share of the remaining budget, then the newest turns
+    verbatim, then as many lines of the session's rolling summary as still
+    fit, standing in for the turns that didn't make it in verbatim. Prompt
+    size stays bounded however long the session or its answers get.
+    
+    A product's snippet and its token estimate are rendered the first time
+    the product is retrieved and kept in an LRU of max_snippets entries,
+    dropped whenever the catalog version moves on (see sync_catalog). Memory
+    and reload cost follow the products actually retrieved, not the catalog
+    size.
+    """
+    
+    def __init__(self, token_budget: int = 2000, product_share: float = 0.6, max_snippets: int = 4096):
+        self.token_budget = token_budget
+        self.product_share = product_share
+        self.template_tokens = {
+            language: {name: self.estimate_tokens(text) for name, text in templates.items() if name not in ("product", "product_live")}
+            for language, templates in PROMPT_TEMPLATES.items()
+        }
+        self.snippets = OrderedDict()  # (product id, language) -> (snippet, estimated tokens), most recently used last
+        self.max_snippets = max_snippets
+        self.catalog_version = None
+        self.lock = threading.Lock()
+        self.prompts = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.summarized_prompts = 0
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Rough count: ~4 characters per token for Latin text, ~2 for Khmer"""
+        # Khmer characters take 3 bytes in UTF-8, so half the extra bytes counts each of them once more
+        extra_bytes = len(text.encode("utf-8")) - len(text)
+        return (len(text) + extra_bytes // 2 + 3) // 4
+    
+    def sync_catalog(self, catalog_version: Optional[str]):
+        """Drop the rendered snippets if the catalog version moved on, as product text may have changed"""
+        if catalog_version is None or catalog_version == self.catalog_version:
+            return
+        with self.lock:
+            if catalog_version != self.catalog_version:
+                self.snippets = OrderedDict()
+                self.catalog_version = catalog_version
+    
+    def product_snippet(self, product: dict, language: str):
+        """(snippet, estimated tokens) for a product, rendered on first use"""
+        key = (product.get('id'), language)
+        with self.lock:
+            snippet = self.snippets.get(key)
+            if snippet is not None:
+                self.snippets.move_to_end(key)
+                return snippet
+        snippet = self._render(product, language)
+        if key[0] is not None:
+            with self.lock:
+                self.snippets[key] = snippet
+                while len(self.snippets) > self.max_snippets:
+                    self.snippets.popitem(last=False)
+        return snippet
+    
+    def build(self, products, history, summary_lines, language: str) -> str:
+        """history is newest first; summary_lines oldest first, the last ones covering the newest turns"""
+        language = self._language(language)
+        templates = PROMPT_TEMPLATES[language]
+        remaining = self.token_budget - self.template_tokens[language]["header"] - self.template_tokens[language]["footer"]
+        product_parts, used = self._product_parts(products, language, int(max(remaining, 0) * self.product_share))
+        remaining -= used
+        
+        # Newest turns verbatim, stopping at the first that doesn't fit so the included ones are contiguous
+        turns = []
+        for user_msg, assistant_resp in history:
+            turn = f"User: {user_msg}\nAssistant: {assistant_resp}\n"
+            cost = self.estimate_tokens(turn)
+            if cost > remaining:
+                break
+            turns.append(turn)
+            remaining -= cost
+        turns.reverse()
+        
+        # Summary lines for the turns older than those, newest first while they fit
+        older = list(summary_lines)[:max(len(summary_lines) - len(turns), 0)]
+        summary = []
+        if older:
+            remaining -= self.template_tokens[language]["summary_heading"]
+            for line in reversed(older):
+                cost = self.estimate_tokens(line)
+                if cost > remaining:
+                    break
+                summary.append(line + "\n")
+                remaining -= cost
+            summary.reverse()
+        
+        parts = [templates["header"], "\n\n"]
+        parts += product_parts
+        parts.append("\n\n")
+        if summary:
+            parts += [templates["summary_heading"], "\n"]
+            parts += summary
+        parts += turns
+        parts += ["\n\n", templates["footer"]]
+        prompt = "".join(parts)
+        
+        tokens = self.token_budget - remaining
+        with self.lock:
+            self.prompts += 1
+            self.total_tokens += tokens
+            self.max_tokens = max(self.max_tokens, tokens)
+            if summary:
+                self.summarized_prompts += 1
+        return prompt
+    
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "token_budget": self.token_budget,
+                "catalog_version": self.catalog_version,
+                "product_snippets": len(self.snippets),
+                "prompts": self.prompts,
+                "avg_tokens": round(self.total_tokens / self.prompts, 1) if self.prompts else 0.0,
+                "max_tokens": self.max_tokens,
+                "summarized_prompts": self.summarized_prompts
+            }
+    
+    def _language(self, language: str) -> str:
+        return "km" if language == "km" else "en"
+    
+    def _render(self, product: dict, language: str):
+        snippet = PROMPT_TEMPLATES[language]["product"].format(
+            name=product['name'],
+            brand=product['brand'],
+            description=product['description'],
+            features=product.get('features', ''),
+            category=product['category'],
+            age_range=product['age_range']
+        )
+        return snippet, self.estimate_tokens(snippet)
+    
+    def _product_parts(self, products, language: str, token_budget: Optional[int]):
+        """Numbered product snippets in relevance order and their token estimate.
+        
+        The most relevant product is kept even if it alone exceeds the budget.
+        """
+        templates = PROMPT_TEMPLATES[language]
+        if not products:
+            return [templates["no_products"]], self.template_tokens[language]["no_products"]
+        parts = [templates["products_heading"], "\n"]
+        used = self.template_tokens[language]["products_heading"]
+        count = 0
+        for product in products:
+            snippet, cost = self.product_snippet(product, language)
+            live = templates["product_live"].format(price=product['price'], stock=product['stock'])
+            cost += self.estimate_tokens(live)
+            if count and token_budget is not None and used + cost > token_budget:
+                break
+            count += 1
+            parts += [f"{count}. ", snippet, live]
+            used += cost
+        return parts, used
 
-{product_context}
+def llm_input_text(llm_input) -> str:
+    """The text of a direct Gemini prompt or a LangChain message list"""
+    return llm_input if isinstance(llm_input, str) else "\n".join(message.content for message in llm_input)
 
-{conversation_context}
+class _StreamFlight:
+    """One shared streamed LLM reply: the deltas so far and who is still reading them"""
+    
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.listeners = 0
+        self.task = None
+        self.changed = asyncio.Event()
+    
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
 
-Please respond in English and use the product information above to provide helpful responses.
-Maintain natural conversation flow and be positive about learning and education."""
-            
-            # Create the final prompt
-            prompt = system_prompt.format(
-                product_context=product_context,
-                conversation_context=conversation_context
+class LLMSingleFlight:
+    """Collapses identical in-flight LLM calls into one.
+    
+    Calls are keyed by a hash of the exact model input. While a call for a
+    key is running, further calls with that key wait for the leader's result
+    instead of calling the model again: acall() for whole replies and
+    astream() for streamed replies, where a follower is replayed the deltas generated so far and then gets
+    new ones as they arrive. A stream nobody is reading any more is
+    cancelled. Nothing is kept once a call finishes; repeat questions after
+    that are the semantic response cache's job.
+    """
+    
+    def __init__(self):
+        self.tasks = {}    # key -> asyncio.Task, for acall()
+        self.streams = {}  # key -> _StreamFlight, for astream()
+        self.leaders = Counter()
+        self.collapsed = Counter()
+    
+    @staticmethod
+    def key(llm_input) -> str:
+        return hashlib.sha256(llm_input_text(llm_input).encode("utf-8")).hexdigest()
+    
+    async def acall(self, key: str, coro_factory):
+        task = self.tasks.get(key)
+        if task is None:
+            # The call runs as its own task, so a leader whose client goes away doesn't cancel it for the followers
+            task = asyncio.ensure_future(coro_factory())
+            self.tasks[key] = task
+            task.add_done_callback(functools.partial(self._call_done, key))
+            self.leaders["ainvoke"] += 1
+        else:
+            self.collapsed["ainvoke"] += 1
+        return await asyncio.shield(task)
+    
+    async def astream(self, key: str, stream_factory):
+        flight = self.streams.get(key)
+        if flight is None:
+            flight = self.streams[key] = _StreamFlight()
+            flight.task = asyncio.ensure_future(self._produce(key, flight, stream_factory))
+            self.leaders["stream"] += 1
+        else:
+            self.collapsed["stream"] += 1
+        flight.listeners += 1
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            flight.listeners -= 1
+            if flight.listeners == 0 and not flight.done:
+                if self.streams.get(key) is flight:
+                    del self.streams[key]
+                flight.task.cancel()
+    
+    def stats(self) -> dict:
+        return {
+            "leaders": dict(self.leaders),
+            "collapsed": dict(self.collapsed),
+            "in_flight": len(self.tasks) + len(self.streams)
+        }
+    
+    def _call_done(self, key: str, task: asyncio.Task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here so an error nobody awaited isn't logged as unhandled
+    
+    async def _produce(self, key: str, flight: _StreamFlight, stream_factory):
+        try:
+            async for delta in stream_factory():
+                flight.chunks.append(delta)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+            if self.streams.get(key) is flight:
+                del self.streams[key]
+
+class LLMOverloaded(Exception):
+    """Raised instead of queueing when the LLM scheduler is shedding load"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM queue is full, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+RETRYABLE_LLM_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_LLM_MESSAGE = re.compile(r"\b(?:429|500|502|503|504)\b|resource.?exhausted|quota|rate.?limit|unavailable|overloaded", re.IGNORECASE)
+
+def is_retryable_llm_error(error: Exception) -> bool:
+    """True for rate-limit (429) and server (5xx) errors, from google.api_core or wrapped by LangChain"""
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_LLM_STATUS
+    return bool(RETRYABLE_LLM_MESSAGE.search(str(error)))
+
+class TokenBucket:
+    """Refills at rate_per_minute / 60 per second, holding at most a minute's worth; a rate of 0 never limits"""
+    
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken (amounts above capacity count as a full bucket)"""
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+    
+    def take(self, amount: float):
+        if self.rate:
+            self.tokens -= min(amount, self.capacity)
+
+class LLMScheduler:
+    """Admission control and retries for LLM calls.
+    
+    At most max_concurrency calls run at once, and each must also fit the
+    requests-per-minute and tokens-per-minute buckets (0 disables one).
+    A call that can't start waits up to queue_timeout seconds. Past that,
+    or with max_queue calls already waiting, it fails fast with
+    LLMOverloaded, and so does every new call for the next shed_window
+    seconds rather than joining a queue known to be too slow. Calls
+    failing with a 429 or 5xx are retried up to max_retries times with
+    jittered exponential backoff; streams only until their first delta.
+    Runs on the event loop, so the counters need no lock.
+    """
+    
+    def __init__(self, max_concurrency: int = 8, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 queue_timeout: float = 10.0, max_queue: int = 100, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, shed_window: float = 1.0,
+                 latency: Optional[LatencyRecorder] = None):
+        self.max_concurrency = max_concurrency
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.shed_window = shed_window
+        self.latency = latency
+        self.shed_until = 0.0
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.retries = 0
+        self.rate_limit_waits = 0
+    
+    def overloaded(self) -> bool:
+        """True while new calls would be shed straight away"""
+        return self.waiting >= self.max_queue or time.monotonic() < self.shed_until
+    
+    async def arun(self, tokens: int, coro_factory):
+        await self._admit(tokens)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return await coro_factory()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable_llm_error(e):
+                        raise
+                    error = e
+                attempt += 1
+                await self._backoff(attempt, tokens, error)
+        finally:
+            self._release()
+    
+    async def astream(self, tokens: int, stream_factory):
+        await self._admit(tokens)
+        try:
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    async for delta in stream_factory():
+                        started = True
+                        yield delta
+                    return
+                except Exception as e:
+                    # Deltas already sent can't be taken back, so only a stream that hasn't started is retried
+                    if started or attempt >= self.max_retries or not is_retryable_llm_error(e):
+                        raise
+                    error = e
+                attempt += 1
+                await self._backoff(attempt, tokens, error)
+        finally:
+            self._release()
+    
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "retries": self.retries,
+            "rate_limit_waits": self.rate_limit_waits,
+            "shedding": self.overloaded()
+        }
+    
+    async def _admit(self, tokens: int):
+        start = time.monotonic()
+        if self.overloaded():
+            self._shed(start)
+        deadline = start + self.queue_timeout
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            try:
+                await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._shed(time.monotonic(), start_window=True)
+            try:
+                await self._wait_for_rate(tokens, deadline)
+            except BaseException:
+                # Shed or cancelled (client gone, last single-flight listener left) while waiting for quota
+                self.slots.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.admitted += 1
+        if self.latency:
+            self.latency.record("llm_queue_wait", time.monotonic() - start)
+    
+    def _release(self):
+        self.running -= 1
+        self.slots.release()
+    
+    async def _wait_for_rate(self, tokens: int, deadline: Optional[float]):
+        while True:
+            now = time.monotonic()
+            wait = max(self.request_bucket.wait_time(1, now), self.token_bucket.wait_time(tokens, now))
+            if not wait:
+                self.request_bucket.take(1)
+                self.token_bucket.take(tokens)
+                return
+            if deadline is not None and now + wait > deadline:
+                self._shed(now, start_window=True)
+            self.rate_limit_waits += 1
+            await asyncio.sleep(wait)
+    
+    async def _backoff(self, attempt: int, tokens: int, error: Exception):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        self.retries += 1
+        logger.warning(f"LLM call failed ({error}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+        # Retries spend quota too
+        await self._wait_for_rate(tokens, None)
+    
+    def _shed(self, now: float, start_window: bool = False):
+        if start_window:
+            self.shed_until = max(self.shed_until, now + self.shed_window)
+        self.shed += 1
+        raise LLMOverloaded(max(self.shed_until - now, self.shed_window))
+
+class EducationStoreRAG:
+    def __init__(self):
+        session_cache = None
+        if os.getenv("SESSION_CACHE", "1") == "1":
+            session_cache = SessionHistoryCache(
+                max_turns=10,
+                max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "10000")),
+                max_bytes=int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                ttl=float(os.getenv("SESSION_CACHE_TTL", "1800"))
             )
+        self.memory = ConversationMemory(
+            db_pool,
+            write_behind=os.getenv("CONVERSATION_WRITE_BEHIND", "1") == "1",
+            flush_size=int(os.getenv("CONVERSATION_FLUSH_SIZE", "50")),
+            flush_interval=float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5")),
+            session_cache=session_cache,
+            summary_lines=int(os.getenv("CONVERSATION_SUMMARY_LINES", "20")),
+            max_pending=int(os.getenv("CONVERSATION_MAX_PENDING", "10000")),
+            backoff_max=float(os.getenv("CONVERSATION_FLUSH_BACKOFF_MAX", "30"))
+        )
+        self.prompt_builder = PromptBuilder(
+            token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "2000")),
+            max_snippets=int(os.getenv("PROMPT_SNIPPET_CACHE_SIZE", "4096"))
+        )
+        self.inventory = ProductInventory(db_pool, ttl=float(os.getenv("INVENTORY_CACHE_TTL", "5")))
+        self.latency = LatencyRecorder()
+        self.tts_service = TextToSpeechService(http_pool)
+        self.chroma_store = ChromaStore(count_ttl=float(os.getenv("CHROMA_COUNT_TTL", "5")))
+        self.product_search = ChromaProductSearch(self.chroma_store, self.inventory)
+        self.llm = llm
+        self.model = model if not LANGCHAIN_AVAILABLE else None
+        # Byte-identical prompts already being answered (e.g. a burst of the same opening question) share one LLM call
+        self.single_flight = LLMSingleFlight() if os.getenv("LLM_SINGLE_FLIGHT", "1") == "1" else None
+        # Price/stock lookups for a named product are answered from product data without the LLM
+        self.lookup_router = LookupRouter() if os.getenv("LOOKUP_ROUTER", "1") == "1" else None
+        # Bounds concurrent Gemini calls, keeps them under the quota and retries 429/5xx
+        self.llm_scheduler = LLMScheduler(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "10")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "100")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            latency=self.latency
+        )
+        # Dedicated pool for blocking I/O so a slow gTTS or SQLite call never stalls the event loop
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RAG_EXECUTOR_WORKERS", "16")),
+            thread_name_prefix="rag-io"
+        )
+        self.response_cache = SemanticResponseCache(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024"))
+        )
+        self.response_cache_enabled = os.getenv("SEMANTIC_CACHE", "1") == "1"
+        # Sentence-level TTS pipelining for "voice"/"both" responses
+        self.tts_pipeline_enabled = os.getenv("TTS_PIPELINE", "1") == "1"
+        self.tts_pipeline_min_chars = int(os.getenv("TTS_PIPELINE_MIN_CHARS", "40"))
+    
+    def search_products(self, query: str, query_embedding: Optional[np.ndarray] = None):
+        """Product search with live price and stock, dropping stale prompt snippets first if the catalog changed"""
+        self.prompt_builder.sync_catalog(self.product_search.catalog_version())
+        return self.product_search.search_products(query, query_embedding=query_embedding)
+
+    def build_prompt(self, products, history, language: str = "en", summary_lines=()) -> str:
+        start = time.perf_counter()
+        prompt = self.prompt_builder.build(products, history, summary_lines, language)
+        elapsed = time.perf_counter() - start
+        self.latency.record("prompt_build", elapsed)
+        logger.debug(f"Built {language} prompt in {elapsed * 1000:.2f} ms")
+        return prompt
+
+    def _route_lookup(self, user_message: str, language: str) -> Optional[str]:
+        """Templated reply from live product data for a simple price/stock lookup, or None to escalate to the LLM"""
+        if not self.lookup_router:
+            return None
+        start = time.perf_counter()
+        route = self.lookup_router.classify(user_message, self.product_search.lexical_index() if self.product_search.collection else None)
+        if route is None:
+            return None
+        intents, product = route
+        response_text = self.lookup_router.answer(self.inventory.apply([product])[0], intents, language)
+        self.latency.record("lookup_reply", time.perf_counter() - start)
+        return response_text
+
+    def _llm_input(self, user_message: str, prompt: str):
+        """Build the LangChain message list or the direct Gemini prompt string"""
+        if self.llm and LANGCHAIN_AVAILABLE:
+            return [HumanMessage(content=f"User question: {user_message}\n\nContext: {prompt}")]
+        elif self.model:
+            return f"{prompt}\n\nCurrent user question: {user_message}\n\nResponse:"
+        raise Exception("No AI model available")
+
+    async def _ainvoke_llm(self, user_message: str, prompt: str) -> str:
+        llm_input = self._llm_input(user_message, prompt)
+        tokens = PromptBuilder.estimate_tokens(llm_input_text(llm_input))
+        call = functools.partial(self.llm_scheduler.arun, tokens, functools.partial(self._acall_llm, llm_input))
+        with self.latency.time("llm_reply"):
+            if self.single_flight:
+                return await self.single_flight.acall(LLMSingleFlight.key(llm_input), call)
+            return await call()
+
+    async def _acall_llm(self, llm_input) -> str:
+        if isinstance(llm_input, list):
+            response = await self.llm.ainvoke(llm_input)
+            return response.content
+        response = await self.model.generate_content_async(llm_input, **gemini_request_kwargs)
+        return response.text
+
+    def _demo_text(self, language: str) -> str:
+        return DEMO_MESSAGES["km" if language == "km" else "en"]
+
+    def _error_text(self, language: str) -> str:
+        return ERROR_MESSAGES["km" if language == "km" else "en"]
+
+    def _wants_audio(self, response_type: str) -> bool:
+        return response_type in ["voice", "both"]
+
+    def _audio_url(self, audio_id: Optional[str]) -> Optional[str]:
+        return f"/audio/{audio_id}" if audio_id else None
+
+    def _embed_query(self, user_message: str, first_turn: bool = True):
+        """Query embedding (reused for product search) and the catalog version stamp for the response cache"""
+        catalog_version = self._response_cache_version() if self.response_cache_enabled else None
+        # Only first turns consult the response cache; otherwise the embedding is just for product
+        # search, which doesn't need it when the lexical index settles the query
+        if not (first_turn and catalog_version is not None) and self.product_search.lexical_decisive(user_message):
+            return None, catalog_version
+        query_embedding = self.product_search.embed_query(user_message)
+        return query_embedding, catalog_version
+
+    def _response_cache_version(self) -> Optional[str]:
+        """Cached replies quote prices and stock, so they expire with inventory changes as well as catalog ones"""
+        catalog_version = self.product_search.catalog_version()
+        if catalog_version is None:
+            return None
+        return f"{catalog_version}|{self.inventory.version()}"
+    
+    def _cached_reply(self, user_message: str, history, language: str, query_embedding, catalog_version):
+        """Look up the semantic response cache; returns (cached text, slot to store a fresh reply under)"""
+        # Only first turns are cacheable, later replies depend on the conversation so far
+        if history or query_embedding is None or catalog_version is None:
+            return None, None
+        # "under $50" and "under $100" embed almost identically but need different answers
+        constraints = self.product_search.parse_constraints(user_message)
+        bucket = f"{language}|{constraints.key()}" if constraints else language
+        cache_slot = (query_embedding, bucket, catalog_version)
+        return self.response_cache.lookup(*cache_slot), cache_slot
+
+    def _remember_reply(self, cache_slot, response_text: str):
+        if cache_slot is not None:
+            self.response_cache.store(*cache_slot, response_text)
+
+    async def _aretrieve(self, user_message: str, user_id: str, session_id: str, language: str):
+        """Return (cached reply, prompt, cache slot); exactly one of cached reply / prompt is set.
+        
+        The session summary is looked up while the query is embedded.
+        """
+        # History comes first (usually from the session cache) since it decides whether the embedding is needed
+        history = await self._run_blocking(self.memory.get_conversation_history, user_id, session_id)
+        (summary_lines, _), (query_embedding, catalog_version) = await asyncio.gather(
+            self._run_blocking(self.memory.get_session_summary, user_id, session_id),
+            self._run_blocking(self._embed_query, user_message, not history)
+        )
+        cached_text, cache_slot = self._cached_reply(user_message, history, language, query_embedding, catalog_version)
+        if cached_text is not None:
+            return cached_text, None, None
+        products = await self._run_blocking(self.search_products, user_message, query_embedding)
+        return None, self.build_prompt(products, history, language, summary_lines), cache_slot
+
+    async def _run_blocking(self, func, *args):
+        """Run blocking SQLite/ChromaDB/gTTS work on the RAG executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _aaudio_url(self, text: str, language: str, response_type: str) -> Optional[str]:
+        if not self._wants_audio(response_type):
+            return None
+        audio_id = await self._run_blocking(self.tts_service.synthesize_to_id, text, language)
+        return self._audio_url(audio_id)
+
+    async def agenerate_response(self, user_message: str, user_id: str, session_id: str, response_type: str = "both", language: str = "en"):
+        """Reply to a chat message without blocking the event loop; the only non-streaming response path"""
+        try:
+            routed_text = await self._run_blocking(self._route_lookup, user_message, language)
+            if routed_text is not None:
+                _, audio_url = await asyncio.gather(
+                    self._run_blocking(self.memory.store_conversation, user_id, session_id, user_message, routed_text),
+                    self._aaudio_url(routed_text, language, response_type)
+                )
+                return {
+                    "text": routed_text,
+                    "audio_url": audio_url,
+                    "response_type": response_type
+                }
             
-            response_text = ""
-            
-            # Use LangChain if available, otherwise use direct Gemini
-            if self.llm and LANGCHAIN_AVAILABLE:
-                # Use LangChain with Gemini
-                messages = [
-                    HumanMessage(content=f"User question: {user_message}\n\nContext: {prompt}")
-                ]
-                response = self.llm.invoke(messages)
-                response_text = response.content
-            elif self.model:
-                # Use direct Gemini API
-                full_prompt = f"{prompt}\n\nCurrent user question: {user_message}\n\nResponse:"
-                response = self.model.generate_content(full_prompt)
-                response_text = response.text
-            else:
-                raise Exception("No AI model available")
+            if not self.llm and not self.model:
+                simple_response = self._demo_text(language)
+                return {
+                    "text": simple_response,
+                    "audio_url": await self._aaudio_url(simple_response, language, response_type),
+                    "response_type": response_type
+                }
             
-            # Store conversation
-            self.memory.store_conversation(user_id, session_id, user_message, response_text)
+            cached_text, prompt, cache_slot = await self._aretrieve(user_message, user_id, session_id, language)
             
-            # Generate audio if needed
-            audio_data = None
-            if response_type in ["voice", "both"]:
-                audio_data = self.tts_service.text_to_speech(response_text, language)
+            pipeline = self._audio_pipeline(language, response_type)
+            if cached_text is not None:
+                response_text = cached_text
+                _, audio_url = await asyncio.gather(
+                    self._run_blocking(self.memory.store_conversation, user_id, session_id, user_message, response_text),
+                    self._aaudio_url(response_text, language, response_type)
+                )
+            elif pipeline:
+                # Stream the reply so sentence audio is synthesized while the rest is generated
+                chunks = []
+                try:
+                    async for delta in self._astream_llm(user_message, prompt):
+                        chunks.append(delta)
+                        pipeline.feed(delta)
+                except Exception:
+                    pipeline.cancel()
+                    raise
+                response_text = "".join(chunks)
+                pipeline.close()
+                _, segment_ids = await asyncio.gather(
+                    self._run_blocking(self.memory.store_conversation, user_id, session_id, user_message, response_text),
+                    pipeline.collect()
+                )
+                audio_id = await self._run_blocking(self.tts_service.join_audio, response_text, language, segment_ids)
+                audio_url = self._audio_url(audio_id)
+                self._remember_reply(cache_slot, response_text)
+            else:
+                response_text = await self._ainvoke_llm(user_message, prompt)
+                self._remember_reply(cache_slot, response_text)
+                
+                # Storing the turn and synthesizing audio are independent as well
+                _, audio_url = await asyncio.gather(
+                    self._run_blocking(self.memory.store_conversation, user_id, session_id, user_message, response_text),
+                    self._aaudio_url(response_text, language, response_type)
+                )
             
             return {
                 "text": response_text,
-                "audio_data": audio_data,
+                "audio_url": audio_url,
                 "response_type": response_type
             }
         
+        except LLMOverloaded:
+            # The endpoint answers 503 so clients back off instead of reading an apology
+            raise
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            if language == "km":
-                error_text = "សូមអភ័យទោស ខ្ញុំមានបញ្ហាក្នុងការដំណើរការសំណើរបស់អ្នកឥឡូវនេះ។ សូមព្យាយាមម្តងទៀត។"
-            else:
-                error_text = "I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
-            
-            audio_data = None
-            if response_type in ["voice", "both"]:
-                audio_data = self.tts_service.text_to_speech(error_text, language)
-            
+            error_text = self._error_text(language)
             return {
                 "text": error_text,
-                "audio_data": audio_data,
+                "audio_url": await self._aaudio_url(error_text, language, response_type),
                 "response_type": response_type
             }
 
-def get_db_connection():
-    """Get SQLite database connection"""
-    try:
-        conn = sqlite3.connect('education_store.db')
-        conn.row_factory = sqlite3.Row
-        return conn
-    except Exception as e:
-        logger.error(f"SQLite connection error: {e}")
-        return None
+    async def _astream_llm(self, user_message: str, prompt: str):
+        """Yield text deltas from the LLM as they arrive"""
+        llm_input = self._llm_input(user_message, prompt)
+        tokens = PromptBuilder.estimate_tokens(llm_input_text(llm_input))
+        scheduled = functools.partial(self.llm_scheduler.astream, tokens, functools.partial(self._astream_llm_input, llm_input))
+        stream = self.single_flight.astream(LLMSingleFlight.key(llm_input), scheduled) if self.single_flight else scheduled()
+        start = time.perf_counter()
+        try:
+            async for delta in stream:
+                yield delta
+            self.latency.record("llm_reply", time.perf_counter() - start)
+        finally:
+            # Stop listening right away when our caller stops, so an abandoned shared stream is cancelled
+            await stream.aclose()
+
+    async def _astream_llm_input(self, llm_input):
+        if isinstance(llm_input, list):
+            async for chunk in self.llm.astream(llm_input):
+                if chunk.content:
+                    yield chunk.content
+        else:
+            response = await self.model.generate_content_async(llm_input, stream=True, **gemini_request_kwargs)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+    async def astream_response(self, user_message: str, user_id: str, session_id: str, response_type: str = "both", language: str = "en"):
+        """Streaming counterpart of agenerate_response.
+
+        Yields (event, data) pairs: "token" for each text delta, "error" if
+        generation fails (its text replaces anything streamed so far), and
+        for voice responses either ordered "audio_segment" events interleaved
+        with the tokens (sentence pipelining) or one trailing "audio" event.
+        Audio events carry an /audio URL rather than the audio itself.
+        """
+        pipeline = self._audio_pipeline(language, response_type)
+        try:
+            routed_text = await self._run_blocking(self._route_lookup, user_message, language)
+            if routed_text is not None:
+                response_text = routed_text
+                yield "token", {"text": response_text}
+                if pipeline:
+                    pipeline.feed(response_text)
+                await self._run_blocking(self.memory.store_conversation, user_id, session_id, user_message, response_text)
+            elif not self.llm and not self.model:
+                response_text = self._demo_text(language)
+                yield "token", {"text": response_text}
+                if pipeline:
+                    pipeline.feed(response_text)
+            else:
+                cached_text, prompt, cache_slot = await self._aretrieve(user_message, user_id, session_id, language)
+                if cached_text is not None:
+                    response_text = cached_text
+                    yield "token", {"text": response_text}
+                    if pipeline:
+                        pipeline.feed(response_text)
+                else:
+                    chunks = []
+                    async for delta in self._astream_llm(user_message, prompt):
+                        chunks.append(delta)
+                        yield "token", {"text": delta}
+                        if pipeline:
+                            pipeline.feed(delta)
+                            for index, audio_id in pipeline.ready_segments():
+                                yield "audio_segment", {"index": index, "audio_url": self._audio_url(audio_id)}
+                    response_text = "".join(chunks)
+                    self._remember_reply(cache_slot, response_text)
+                
+                await self._run_blocking(self.memory.store_conversation, user_id, session_id, user_message, response_text)
+        
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            response_text = self._error_text(language)
+            yield "error", {"text": response_text}
+            if pipeline:
+                # Drop audio for the abandoned reply and speak the apology instead
+                pipeline.cancel()
+                pipeline = self._audio_pipeline(language, response_type)
+                pipeline.feed(response_text)
+        
+        if pipeline:
+            pipeline.close()
+            async for index, audio_id in pipeline.remaining_segments():
+                yield "audio_segment", {"index": index, "audio_url": self._audio_url(audio_id)}
+        else:
+            audio_url = await self._aaudio_url(response_text, language, response_type)
+            if audio_url:
+                yield "audio", {"audio_url": audio_url}
+
+    def _audio_pipeline(self, language: str, response_type: str) -> Optional[SentenceAudioPipeline]:
+        if not (self.tts_pipeline_enabled and self._wants_audio(response_type)):
+            return None
+        return SentenceAudioPipeline(self.tts_service, language, self._run_blocking, self.tts_pipeline_min_chars)
+
+# Shared keep-alive pool for outbound HTTP (gTTS)
+http_pool = PooledHTTPClient(
+    max_connections=int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "20")),
+    max_keepalive=int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+    connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "20")),
+    http2=os.getenv("HTTP2", "1") == "1"
+) if HTTPX_AVAILABLE else None
+if http_pool and not GTTS_POOLABLE:
+    logger.warning("Installed gTTS has no _prepare_requests(), so TTS requests use gTTS's own session instead of the pool")
+
+# Shared SQLite pool for conversation memory and live price/stock; EDUCATION_STORE_DB, or
+# education_store.db next to this file, the same database init_database.py writes to
+db_pool = SQLiteConnectionPool(
+    os.path.abspath(os.getenv("EDUCATION_STORE_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "education_store.db")),
+    size=int(os.getenv("SQLITE_POOL_SIZE", "8")),
+    busy_timeout_ms=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+)
+
+# Bring the schema (indexes, archive table) up to date before serving
+try:
+    with db_pool.connection() as conn:
+        for migration in migrate_sqlite_db(conn):
+            logger.info(f"Applied SQLite migration: {migration}")
+except Exception as e:
+    logger.error(f"SQLite migration failed: {e}")
+
+def compact_conversations(retention_days: int):
+    with db_pool.connection() as conn:
+        return compact_conversation_history(conn, retention_days)
 
 # Initialize RAG system
 rag_system = EducationStoreRAG()
 
+@app.on_event("startup")
+async def prewarm_tts_cache():
+    """Synthesize the fixed bilingual demo/error messages in the background"""
+    messages = [
+        (text, lang)
+        for fixed in (DEMO_MESSAGES, ERROR_MESSAGES)
+        for lang, text in fixed.items()
+    ]
+    app.state.tts_prewarm = asyncio.ensure_future(
+        rag_system._run_blocking(rag_system.tts_service.prewarm, messages)
+    )
+
+@app.on_event("startup")
+async def start_conversation_compaction():
+    """Periodically archive idle sessions so conversation_history stays small"""
+    retention_days = int(os.getenv("CONVERSATION_RETENTION_DAYS", "30"))
+    interval = float(os.getenv("CONVERSATION_COMPACTION_INTERVAL", "3600"))
+    if retention_days <= 0:
+        return
+    
+    async def compaction_loop():
+        while True:
+            try:
+                sessions, turns = await rag_system._run_blocking(compact_conversations, retention_days)
+                if sessions:
+                    logger.info(f"Archived {sessions} idle sessions ({turns} turns)")
+            except Exception as e:
+                logger.error(f"Conversation compaction failed: {e}")
+            await asyncio.sleep(interval)
+    
+    app.state.compaction_task = asyncio.ensure_future(compaction_loop())
+
+@app.on_event("shutdown")
+def shutdown_storage():
+    """Stop background jobs, flush buffered conversation turns, then close the SQLite and HTTP pools"""
+    compaction_task = getattr(app.state, "compaction_task", None)
+    if compaction_task:
+        compaction_task.cancel()
+    rag_system.product_search.close()
+    rag_system.memory.close()
+    db_pool.close()
+    if http_pool:
+        http_pool.close()
+
+def overloaded_error(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="The assistant is busy, please try again shortly",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
 @app.post("/chat", response_model=AssistantResponse)
 async def chat_endpoint(user_message: UserMessage):
     try:
         if not user_message.session_id:
             user_message.session_id = str(uuid.uuid4())
         
-        response_data = rag_system.generate_response(
+        response_data = await rag_system.agenerate_response(
             user_message.message, 
             user_message.user_id, 
             user_message.session_id,
@@ -411,22 +3162,20 @@ async def chat_endpoint(user_message: UserMessage):
             user_message.language
         )
         
-        # Ensure audio_data is not None for the response model
-        audio_data = response_data["audio_data"] or ""
-        
         return AssistantResponse(
             text=response_data["text"],
-            audio_data=audio_data,
+            audio_data="",
+            audio_url=response_data["audio_url"],
             session_id=user_message.session_id,
             response_type=user_message.response_type,
             timestamp=datetime.utcnow().isoformat()
         )
     
+    except LLMOverloaded as e:
+        raise overloaded_error(e.retry_after)
     except Exception as e:
         logger.error(f"Chat endpoint error: {e}")
-        error_text = "I apologize, but I'm having trouble processing your request right now. Please try again in a moment."
-        if user_message.language == "km":
-            error_text = "សូមអភ័យទោស ខ្ញុំមានបញ្ហាក្នុងការដំណើរការសំណើរបស់អ្នកឥឡូវនេះ។ សូមព្យាយាមម្តងទៀត។"
+        error_text = ERROR_MESSAGES["km" if user_message.language == "km" else "en"]
         
         return AssistantResponse(
             text=error_text,
@@ -436,6 +3185,110 @@ async def chat_endpoint(user_message: UserMessage):
             timestamp=datetime.utcnow().isoformat()
         )
 
+def format_sse(event: str, data: dict) -> str:
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(user_message: UserMessage):
+    """Stream the reply as server-sent events: meta, token*, [error], [audio], done"""
+    if rag_system.llm_scheduler.overloaded():
+        # Shed before the 200 and the event stream start; overloads later in the stream become an error event
+        raise overloaded_error(rag_system.llm_scheduler.shed_window)
+    if not user_message.session_id:
+        user_message.session_id = str(uuid.uuid4())
+    
+    async def event_stream():
+        yield format_sse("meta", {
+            "session_id": user_message.session_id,
+            "response_type": user_message.response_type
+        })
+        async for event, data in rag_system.astream_response(
+            user_message.message,
+            user_message.user_id,
+            user_message.session_id,
+            user_message.response_type,
+            user_message.language
+        ):
+            yield format_sse(event, data)
+        yield format_sse("done", {"timestamp": datetime.utcnow().isoformat()})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+AUDIO_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+def audio_media_type(audio_bytes: bytes) -> str:
+    """WAV from a local TTS backend, otherwise MP3 from gTTS"""
+    return "audio/wav" if audio_bytes.startswith(b"RIFF") else "audio/mpeg"
+
+
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+def parse_byte_range(range_header: str, size: int):
+    """Parse a single "bytes=start-end" range; returns (start, end) inclusive or raises ValueError"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError("Only single byte ranges are supported")
+    start_text, _, end_text = spec.strip().partition("-")
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(end_text), 0)
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+def iter_audio_chunks(audio_bytes: bytes):
+    view = memoryview(audio_bytes)
+    for offset in range(0, len(view), AUDIO_CHUNK_SIZE):
+        yield bytes(view[offset:offset + AUDIO_CHUNK_SIZE])
+
+@app.get("/audio/{audio_id}")
+async def audio_endpoint(audio_id: str, request: Request):
+    """Stream synthesized speech (audio/mpeg, or audio/wav from a local backend) with ETag and Range support"""
+    audio_bytes = None
+    if AUDIO_ID_PATTERN.fullmatch(audio_id):
+        audio_bytes = await rag_system._run_blocking(rag_system.tts_service.get_audio, audio_id)
+    if audio_bytes is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    
+    # Audio ids are content addresses, so the bytes behind an id never change
+    etag = f'"{audio_id}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    size = len(audio_bytes)
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            start, end = parse_byte_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_audio_chunks(audio_bytes[start:end + 1]),
+            status_code=206,
+            media_type=audio_media_type(audio_bytes),
+            headers=headers
+        )
+    
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_audio_chunks(audio_bytes), media_type=audio_media_type(audio_bytes), headers=headers)
+
 @app.get("/")
 async def serve_frontend():
     return FileResponse('../frontend/index.html')
@@ -444,28 +3297,49 @@ async def serve_frontend():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
+@app.get("/metrics")
+async def metrics():
+    """Cache and pipeline counters"""
+    return {
+        "tts_cache": rag_system.tts_service.cache.stats(),
+        "tts_backends": {lang: backend.name for lang, backend in rag_system.tts_service.backends.items()},
+        "response_cache": rag_system.response_cache.stats(),
+        "conversation_writes": rag_system.memory.stats(),
+        "prompt": rag_system.prompt_builder.stats(),
+        "latency": rag_system.latency.stats(),
+        "retrieval": rag_system.product_search.stats(),
+        "inventory": rag_system.inventory.stats(),
+        "chroma": rag_system.chroma_store.stats(),
+        "llm_single_flight": rag_system.single_flight.stats() if rag_system.single_flight else None,
+        "llm_scheduler": rag_system.llm_scheduler.stats(),
+        "routes": rag_system.lookup_router.stats() if rag_system.lookup_router else None,
+        "http_pool": http_pool.stats() if http_pool else None
+    }
+
 @app.get("/test-db")
 async def test_database():
     """Test endpoint to check database connections"""
     # Test SQLite
-    sqlite_conn = get_db_connection()
-    sqlite_status = "connected" if sqlite_conn else "disconnected"
+    try:
+        with db_pool.connection() as conn:
+            conn.execute("SELECT 1")
+        sqlite_status = "connected"
+    except Exception as e:
+        sqlite_status = f"error: {str(e)}"
     
-    # Test ChromaDB
+    # Test ChromaDB through the shared handle; the count is cached, so probes stay cheap
     try:
-        chroma_client = chromadb.PersistentClient(path="./chroma_db")
-        chroma_collection = chroma_client.get_collection("education_products")
-        chroma_status = "connected"
-        product_count = chroma_collection.count()
+        product_count = rag_system.chroma_store.count()
+        chroma_status = "connected" if product_count is not None else f"error: {rag_system.chroma_store.error}"
     except Exception as e:
         chroma_status = f"error: {str(e)}"
-        product_count = 0
+        product_count = None
     
     return {
         "sqlite_status": sqlite_status,
         "chromadb_status": chroma_status,
-        "vector_products_count": product_count,
-        "gemini_configured": (llm is not None) or (model is not None),
+        "vector_products_count": product_count or 0,
+        "gemini_configured": (rag_system.llm is not None) or (rag_system.model is not None),
         "langchain_available": LANGCHAIN_AVAILABLE
     }
 
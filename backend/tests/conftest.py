@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# main.py opens its stores at import time; keep them away from the real databases
+_tmp = tempfile.mkdtemp(prefix="edusmart_tests_")
+os.environ.setdefault("EDUCATION_STORE_DB", os.path.join(_tmp, "education_store.db"))
+os.environ.setdefault("CHROMA_DB_PATH", os.path.join(_tmp, "chroma_db"))
+os.environ.setdefault("TTS_CACHE_DIR", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
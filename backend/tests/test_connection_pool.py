@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from main import SQLiteConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLiteConnectionPool(str(tmp_path / "store.db"), size=1)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+    yield pool
+    pool.close()
+
+
+def test_sql_misuse_returns_the_connection_rolled_back(pool):
+    with pytest.raises(sqlite3.ProgrammingError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO items (id) VALUES (1)")
+            conn.execute("INSERT INTO items (id) VALUES (?)", (1, 2))
+    first = conn
+
+    with pool.connection() as conn:
+        assert conn is first
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+    assert pool.created == 1
+
+
+def test_closed_connection_is_replaced(pool):
+    with pytest.raises(sqlite3.ProgrammingError):
+        with pool.connection() as conn:
+            conn.close()
+            conn.execute("SELECT 1")
+    closed = conn
+    assert pool.created == 0
+
+    with pool.connection() as conn:
+        assert conn is not closed
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+    assert pool.created == 1
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+from init_database import migrate_sqlite_db
+from main import ConversationMemory, SessionHistoryCache, SQLiteConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    db_path = str(tmp_path / "store.db")
+    conn = sqlite3.connect(db_path)
+    migrate_sqlite_db(conn)
+    conn.close()
+    pool = SQLiteConnectionPool(db_path)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("write_behind", [True, False])
+def test_load_racing_with_store_does_not_cache_stale_history(pool, monkeypatch, write_behind):
+    memory = ConversationMemory(pool, write_behind=write_behind, flush_interval=60, session_cache=SessionHistoryCache())
+    load_summary = memory.get_session_summary
+    raced = []
+
+    def get_session_summary(user_id, session_id):
+        # Another request for the session misses the cache and loads while the turn is being stored
+        if not raced:
+            raced.append(memory.get_conversation_history(user_id, session_id))
+        return load_summary(user_id, session_id)
+
+    monkeypatch.setattr(memory, "get_session_summary", get_session_summary)
+    memory.store_conversation("u", "s", "q1", "a1")
+    assert raced == [[]]
+
+    assert memory.get_conversation_history("u", "s") == [("q1", "a1")]
+    memory.flush()
+    assert memory.get_conversation_history("u", "s") == [("q1", "a1")]
+    memory.close()
+
+
+def test_cached_history_is_served_newest_first_and_written_through(pool):
+    cache = SessionHistoryCache(max_turns=3)
+    memory = ConversationMemory(pool, write_behind=True, flush_interval=60, session_cache=cache)
+    memory.store_conversation("u", "s", "q1", "a1")
+    assert memory.get_conversation_history("u", "s") == [("q1", "a1")]
+
+    for n in (2, 3, 4):
+        memory.store_conversation("u", "s", f"q{n}", f"a{n}")
+    assert cache.get(("u", "s"), 3) == [("q4", "a4"), ("q3", "a3"), ("q2", "a2")]
+    memory.close()
+
+
+def test_failing_flushes_keep_only_the_newest_turns(pool, monkeypatch):
+    memory = ConversationMemory(pool, write_behind=True, flush_interval=60, max_pending=2)
+    write_rows = memory._write_rows
+
+    def fail(rows, summaries=None):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(memory, "_write_rows", fail)
+    for n in (1, 2, 3):
+        memory.store_conversation("u", "s", f"q{n}", f"a{n}")
+    memory.flush()
+    assert memory.consecutive_failures == 1
+    assert memory.stats()["dropped_rows"] == 1
+    assert memory.get_conversation_history("u", "s") == [("q3", "a3"), ("q2", "a2")]
+
+    monkeypatch.setattr(memory, "_write_rows", write_rows)
+    memory.flush()
+    assert memory.consecutive_failures == 0
+    assert memory.stats()["pending"] == 0
+    assert memory.get_conversation_history("u", "s") == [("q3", "a3"), ("q2", "a2")]
+    memory.close()
@@ -0,0 +1,31 @@
+import sqlite3
+
+import chromadb
+
+from init_database import migrate_sqlite_db, record_inventory, sync_products, unique_products
+from test_product_search import WordHashEmbedding
+
+
+def test_rows_without_id_are_skipped_and_the_last_duplicate_wins(tmp_path, capsys):
+    products = unique_products([
+        {"id": "1", "product_name": "Globe", "price": "20", "stock": "3"},
+        {"product_name": "No id"},
+        {"id": "", "product_name": "Empty id"},
+        {"id": "1", "product_name": "Globe Deluxe", "price": "25", "stock": "0"},
+        {"id": "2", "product_name": "Atlas", "price": "15", "stock": "8"},
+    ])
+    output = capsys.readouterr().out
+    assert "row 2" in output and "row 3" in output
+    assert [product["product_name"] for product in products] == ["Globe Deluxe", "Atlas"]
+
+    conn = sqlite3.connect(str(tmp_path / "store.db"))
+    migrate_sqlite_db(conn)
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma")).create_collection(
+        "test_products", embedding_function=WordHashEmbedding()
+    )
+    counts = sync_products(collection, record_inventory(products, conn))
+
+    assert counts["added"] == 2
+    assert collection.get(ids=["1"])["metadatas"][0]["product_name"] == "Globe Deluxe"
+    assert conn.execute("SELECT price, stock FROM products WHERE id = '1'").fetchone() == (25.0, 0)
+    conn.close()
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from main import LLMOverloaded, LLMScheduler
+
+
+async def _reply():
+    return "ok"
+
+
+def test_cancel_while_waiting_for_rate_releases_slot():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=2, requests_per_minute=60, queue_timeout=5)
+        scheduler.request_bucket.take(scheduler.request_bucket.capacity)  # drain the bucket so the next call waits for quota
+        waiter = asyncio.ensure_future(scheduler.arun(1, _reply))
+        await asyncio.sleep(0.05)
+        assert scheduler.rate_limit_waits == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.running == 0
+    assert scheduler.waiting == 0
+    assert scheduler.slots._value == 2
+
+
+def test_shed_while_waiting_for_rate_releases_slot():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=1, queue_timeout=0.05)
+        assert await scheduler.arun(1, _reply) == "ok"
+        with pytest.raises(LLMOverloaded):
+            await scheduler.arun(1, _reply)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.slots._value == 1
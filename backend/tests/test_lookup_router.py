@@ -0,0 +1,41 @@
+import pytest
+
+from main import LookupRouter, ProductLexicalIndex
+
+PRODUCTS = [
+    {"id": "2", "name": "Digital Microscope Pro", "brand": "ScienceView", "category": "Science", "price": 129.99, "stock": 12},
+    {"id": "7", "name": "StarGazer Telescope", "brand": "CosmosOptics", "category": "Science", "price": 249.0, "stock": 0},
+]
+
+
+@pytest.fixture
+def index():
+    return ProductLexicalIndex(PRODUCTS, ["" for _ in PRODUCTS])
+
+
+@pytest.mark.parametrize("query, intents, product_id", [
+    ("How much is the Digital Microscope Pro?", ("price",), "2"),
+    ("What's the price of the Digital Microscope Pro?", ("price",), "2"),
+    ("Is the StarGazer Telescope still in stock?", ("stock",), "7"),
+    ("How many units of the Digital Microscope Pro are left?", ("stock",), "2"),
+    ("តើ Digital Microscope Pro មានតម្លៃប៉ុន្មាន?", ("price",), "2"),
+])
+def test_routes_plain_lookups(index, query, intents, product_id):
+    route = LookupRouter().classify(query, index)
+    assert route is not None
+    assert route[0] == intents
+    assert route[1]["id"] == product_id
+
+
+@pytest.mark.parametrize("query", [
+    "How much does shipping cost for the Digital Microscope Pro?",
+    "How much is the warranty on the Digital Microscope Pro?",
+    "Can I return the Digital Microscope Pro if the price drops?",
+    "Is the Digital Microscope Pro available in blue?",
+    "Is the Digital Microscope Pro better than the StarGazer Telescope, and how much is it?",
+    "How much is a telescope?",
+])
+def test_escalates_anything_else(index, query):
+    router = LookupRouter()
+    assert router.classify(query, index) is None
+    assert router.stats()["llm"] == 1
@@ -0,0 +1,97 @@
+import hashlib
+import sqlite3
+
+import chromadb
+import numpy as np
+import pytest
+from chromadb.api.types import EmbeddingFunction
+
+from init_database import migrate_sqlite_db, product_document, product_metadata, upsert_inventory
+from main import ChromaProductSearch, ChromaStore, ProductInventory, QueryConstraints, SQLiteConnectionPool
+
+
+class WordHashEmbedding(EmbeddingFunction):
+    """Bag-of-words vectors, so tests don't download the sentence-transformer model"""
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            vector = np.zeros(64, dtype=np.float32)
+            for word in text.lower().split():
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+            vectors.append(vector)
+        return vectors
+
+
+PRODUCTS = [
+    # Ingested sold out and at full price; restocked and discounted since
+    {"id": "1", "product_name": "Junior Microscope", "category": "Science", "description": "microscope for kids",
+     "features": "", "age_range": "8-12 years", "brand": "LabKid", "price": 150.0, "stock": 0},
+    # Ingested in stock; sold out since
+    {"id": "2", "product_name": "Field Microscope", "category": "Science", "description": "portable microscope",
+     "features": "", "age_range": "10+ years", "brand": "LabKid", "price": 80.0, "stock": 7},
+]
+
+
+@pytest.fixture
+def search(tmp_path):
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma")).create_collection(
+        "test_products", embedding_function=WordHashEmbedding()
+    )
+    collection.add(
+        ids=[product["id"] for product in PRODUCTS],
+        documents=[product_document(product) for product in PRODUCTS],
+        metadatas=[product_metadata(product) for product in PRODUCTS]
+    )
+    db_path = str(tmp_path / "store.db")
+    conn = sqlite3.connect(db_path)
+    migrate_sqlite_db(conn)
+    upsert_inventory(conn, [("1", 90.0, 12), ("2", 80.0, 0)])
+    conn.close()
+
+    store = ChromaStore(path=str(tmp_path / "chroma"), collection_name="test_products")
+    store.embedding_function = WordHashEmbedding()
+    search = ChromaProductSearch(store, ProductInventory(SQLiteConnectionPool(db_path), ttl=0))
+    yield search
+    search.close()
+
+
+def test_where_and_mask_leave_price_and_stock_to_live_values():
+    constraints = QueryConstraints(price_max=100, in_stock=True)
+    assert constraints.inventory_bound
+    assert constraints.where() is None
+
+
+@pytest.mark.parametrize("mode", ["hybrid", "vector"])
+def test_constraints_use_live_inventory(search, mode):
+    search.retrieval_mode = mode
+    in_stock = search.search_products("microscope in stock")
+    assert [product["id"] for product in in_stock] == ["1"]
+    assert in_stock[0]["stock"] == 12
+
+    cheap = search.search_products("microscope under $100")
+    assert {product["id"] for product in cheap} == {"1", "2"}
+
+
+def test_nothing_matching_returns_no_products(search):
+    assert search.search_products("microscope under $50") == []
+    assert search.stats()["constraint_misses"] == 1
+
+
+def test_category_constraint_holds_without_the_lexical_index(search):
+    # Catalog over LEXICAL_INDEX_MAX_PRODUCTS and NUMPY_INDEX_MAX_PRODUCTS: Chroma where filters only
+    search.lexical_index_max_products = 0
+    search.search_backend = "chroma"
+    search._loaded_version = None
+    assert search.lexical_index() is None
+    assert search.search_products("art microscope") == []
+    assert {product["id"] for product in search.search_products("science microscope")} == {"1", "2"}
+
+    # With the numpy index loaded, categories resolve against the catalog's own names
+    search.search_backend = "auto"
+    search._loaded_version = None
+    assert search.lexical_index() is None
+    assert search.parse_constraints("science microscope").categories == ["Science"]